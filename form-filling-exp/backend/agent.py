@@ -13,6 +13,7 @@ Install:
 
 import asyncio
 import json
+import os
 import re
 import sys
 from pathlib import Path
@@ -62,7 +63,12 @@ try:
 except ImportError:
     fitz = None
 
-from pdf_processor import detect_form_fields, DetectedField, FieldType
+from client_pool import ClientPool
+from field_search import FieldSearchIndex
+from pdf_processor import (
+    detect_form_fields, refresh_field_values, save_pdf_bytes, write_field_values, get_widget_index,
+    AppearanceMode, APPEARANCE_MODE, DetectedField, FieldType,
+)
 
 
 # ============================================================================
@@ -80,6 +86,14 @@ class FormFillingSession:
         self.doc = None
         self.pdf_path: str | None = None
         self.output_path: str | None = None
+        # Write committed PDFs to output_path (off for HTTP requests, which use current_pdf_bytes)
+        self.persist_output: bool = True
+        # Background write of the last commit to output_path (see flush_output)
+        self._output_write: asyncio.Task | None = None
+        # field_id -> DetectedField, rebuilt whenever fields is replaced
+        self._field_index: dict[str, DetectedField] = {}
+        self._widget_index: dict | None = None
+        self._search_index: FieldSearchIndex | None = None
         self.fields: list[DetectedField] = []
         self.pending_edits: dict[str, Any] = {}
         self.applied_edits: dict[str, Any] = {}
@@ -94,6 +108,44 @@ class FormFillingSession:
         # Anthropic API key for this session (user-provided)
         self.anthropic_api_key: str | None = None
 
+    @property
+    def fields(self) -> list[DetectedField]:
+        return self._fields
+
+    @fields.setter
+    def fields(self, fields: list[DetectedField]):
+        self._fields = fields
+        self._field_index = {f.field_id: f for f in fields}
+        self._widget_index = None
+        self._search_index = None
+
+    @property
+    def widget_index(self) -> dict:
+        """field_id -> [(page, widget xref)] for the loaded doc, built on first commit."""
+        if self._widget_index is None:
+            self._widget_index = get_widget_index(self.doc, self._fields)
+        return self._widget_index
+
+    @property
+    def search_index(self) -> FieldSearchIndex:
+        """Ranked search index over fields, built on first search."""
+        if self._search_index is None:
+            self._search_index = FieldSearchIndex(self._fields)
+        return self._search_index
+
+    def get_field(self, field_id: str) -> DetectedField | None:
+        """Look up a field by field_id in O(1)."""
+        return self._field_index.get(field_id)
+
+    async def flush_output(self):
+        """Wait for the last commit's background write to output_path to finish."""
+        if self._output_write is not None:
+            try:
+                await self._output_write
+            except Exception as e:
+                print(f"[Session] Failed to write output PDF: {e}")
+            self._output_write = None
+
     def reset(self):
         """Reset session state for a new form filling operation."""
         if self.doc:
@@ -441,8 +493,29 @@ _session_manager = SessionManager()
 _current_session: ContextVar[FormFillingSession | None] = ContextVar('current_session', default=None)
 
 
+
+class _SessionSlot:
+    """
+    Mutable holder for the session a pooled client's tools act on.
+
+    A pooled client's reader tasks inherit their context from the task that
+    connected it, not from the request using it, so the request points the
+    client's slot at its session for the duration of the lease.
+    """
+    __slots__ = ("session",)
+
+    def __init__(self):
+        self.session: FormFillingSession | None = None
+
+
+_session_slot: ContextVar[_SessionSlot | None] = ContextVar('session_slot', default=None)
+
+
 def get_current_session() -> FormFillingSession | None:
     """Get the current session from context (used by tools)."""
+    slot = _session_slot.get()
+    if slot is not None:
+        return slot.session
     return _current_session.get()
 
 
@@ -451,6 +524,229 @@ def set_current_session(session: FormFillingSession | None):
     _current_session.set(session)
 
 
+def load_pdf_into_session(session: FormFillingSession, pdf_path: str) -> dict:
+    """
+    Open a PDF in the session and detect (or reuse) its form fields.
+
+    Backs the load_pdf tool, and is called directly by run_agent_stream /
+    run_agent to preload the document before the model's first turn.
+
+    Returns:
+        The load_pdf tool result
+    """
+    print(f"[load_pdf] Loading: {pdf_path} (session: {session.session_id})")
+    try:
+        if session.doc:
+            session.doc.close()
+        session.doc = fitz.open(pdf_path)
+        session.pdf_path = pdf_path
+
+        # Same form as the previous turn (e.g. the filled PDF on a continuation):
+        # keep the detected fields and labels, only re-read current values
+        reused = bool(session.fields) and refresh_field_values(session.doc, session.fields)
+        if not session.fields and session.is_continuation and session.original_pdf_bytes:
+            # Session restored without fields: the original upload is usually in the field cache
+            fields = detect_form_fields(session.original_pdf_bytes, api_key=session.anthropic_api_key)
+            reused = refresh_field_values(session.doc, fields)
+            if reused:
+                session.fields = fields
+        if reused:
+            # Re-assign so the field and widget indexes follow the new document
+            session.fields = session.fields
+            print(f"[load_pdf] Reusing {len(session.fields)} fields from the session")
+        else:
+            with open(pdf_path, 'rb') as f:
+                pdf_bytes = f.read()
+            session.fields = detect_form_fields(pdf_bytes, api_key=session.anthropic_api_key)
+        session.pending_edits = {}
+        # Don't clear applied_edits if this is a continuation
+        if not session.is_continuation:
+            session.applied_edits = {}
+
+        result = {
+            "success": True,
+            "message": f"Loaded PDF with {len(session.fields)} form fields",
+            "field_count": len(session.fields)
+        }
+        print(f"[load_pdf] Success: {len(session.fields)} fields found")
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+        print(f"[load_pdf] Error: {e}")
+    return result
+
+
+# Largest form whose full field inventory is embedded in the initial prompt
+BOOTSTRAP_MAX_FIELDS = int(os.environ.get("BOOTSTRAP_MAX_FIELDS", "400"))
+
+
+async def commit_pending_edits(session: FormFillingSession, output_path: str | None = None) -> dict:
+    """
+    Apply the session's staged edits to its document and save the PDF.
+
+    Shared by the commit_edits tool and the budget auto-commit in the run loop.
+    """
+    output_path = output_path or session.output_path
+    if not output_path:
+        output_path = session.pdf_path.replace('.pdf', '_filled.pdf')
+
+    values = {}
+    for field_id, value in session.pending_edits.items():
+        if APPEARANCE_MODE == AppearanceMode.IMMEDIATE and str(value) == "":
+            # PyMuPDF bug: empty strings don't persist after widget.update()
+            # Use a single space as workaround for "clearing" fields
+            print(f"[commit_edits] Clearing field {field_id}")
+            value = " "
+        values[field_id] = value
+
+    # One pass per page: set every value, then regenerate that page's appearances
+    commit_start = time.perf_counter()
+    timings = {}
+    applied_ids, failed = write_field_values(session.doc, values, session.widget_index, timings=timings)
+    edit_times = timings.get("edits", {})
+
+    applied = []
+    for field_id in applied_ids:
+        value = session.pending_edits[field_id]
+        applied.append({
+            "field_id": field_id,
+            "value": value,
+            "ms": round(edit_times.get(field_id, 0.0) * 1000, 3),
+        })
+        session.applied_edits[field_id] = value
+        print(f"[commit_edits] Applied: {field_id} = {value}")
+    errors = list(failed.values())
+    for error in errors:
+        print(f"[commit_edits] Error: {error}")
+
+    apply_seconds = time.perf_counter() - commit_start
+
+    # Save (incremental update on top of the loaded PDF when possible).
+    # The bytes are produced once and shared by the session and the HTTP layer;
+    # writing them to output_path happens in the background.
+    save_start = time.perf_counter()
+    try:
+        session.current_pdf_bytes = save_pdf_bytes(session.doc)
+        print(f"[commit_edits] Saved {len(session.current_pdf_bytes)} bytes in memory")
+
+        if session.persist_output:
+            await session.flush_output()
+            pdf_bytes = session.current_pdf_bytes
+            session._output_write = asyncio.create_task(
+                asyncio.to_thread(PathlibPath(output_path).write_bytes, pdf_bytes)
+            )
+            print(f"[commit_edits] Writing to: {output_path}")
+    except Exception as e:
+        print(f"[commit_edits] Save error: {e}")
+        errors.append(f"Save failed: {str(e)}")
+    save_seconds = time.perf_counter() - save_start
+
+    session.pending_edits.clear()
+
+    result = {
+        "success": len(errors) == 0,
+        "applied": applied,
+        "applied_count": len(applied),
+        "total_fields_filled": len(session.applied_edits),
+        "errors": errors,
+        "output_path": output_path,
+        "size_bytes": len(session.current_pdf_bytes or b""),
+        "timings": {
+            "apply_ms": round(apply_seconds * 1000, 3),
+            "appearances_ms": round(sum(timings.get("appearances", {}).values()) * 1000, 3),
+            "save_ms": round(save_seconds * 1000, 3),
+        },
+    }
+    print(f"[commit_edits] Result: {result}")
+    return result
+
+
+# ============================================================================
+# Compact Field Listing
+# ============================================================================
+
+# Short type codes for field tables (explained once by _TYPE_LEGEND)
+_TYPE_CODES = {
+    FieldType.TEXT: "txt",
+    FieldType.CHECKBOX: "chk",
+    FieldType.DROPDOWN: "sel",
+    FieldType.RADIO: "rad",
+}
+_TYPE_LEGEND = "types: txt=text chk=checkbox sel=dropdown rad=radio"
+# Options listed per field before the rest are collapsed into a count
+COMPACT_MAX_OPTIONS = 8
+
+
+def _cell(value: Any, limit: int | None = None) -> str:
+    """Render a value as a single table cell (no newlines or column separators)."""
+    if value is None:
+        return ""
+    text = str(value).replace("\n", " ").replace("|", "/").strip()
+    if limit and len(text) > limit:
+        text = text[:limit - 3] + "..."
+    return text
+
+
+def _format_options(options: list[str] | None) -> str:
+    """Collapse an option list into one cell: a/b/c/+N more."""
+    if not options:
+        return ""
+    shown = [_cell(o) for o in options[:COMPACT_MAX_OPTIONS]]
+    if len(options) > COMPACT_MAX_OPTIONS:
+        shown.append(f"+{len(options) - COMPACT_MAX_OPTIONS} more")
+    return "/".join(shown)
+
+
+def _field_row(session: FormFillingSession, f: DetectedField) -> list[str]:
+    """id, type, label, current value and options for one field."""
+    value = session.applied_edits.get(f.field_id, f.current_value)
+    return [
+        f.field_id,
+        _TYPE_CODES.get(f.field_type, f.field_type.value),
+        _cell(f.friendly_label or f.label_context, 80),
+        _cell(value, 80),
+        _format_options(f.options),
+    ]
+
+
+def format_field_table(title: str, header: list[str], rows: list[list[str]]) -> str:
+    """
+    Tabular listing for tool results: a title line, the type legend, a header
+    and one "a | b | c" line per row. Trailing empty cells are dropped.
+    """
+    lines = [title, _TYPE_LEGEND, " | ".join(header)]
+    for row in rows:
+        while row and row[-1] == "":
+            row = row[:-1]
+        lines.append(" | ".join(row))
+    return "\n".join(lines)
+
+
+def _format_field_inventory(session: FormFillingSession) -> str:
+    """Every field with its current value, in the compact table format."""
+    return format_field_table(
+        f"{len(session.fields)} fields",
+        ["id", "type", "label", "value", "options"],
+        [_field_row(session, f) for f in session.fields],
+    )
+
+
+def _bootstrap_prompt_section(session: FormFillingSession) -> str:
+    """Prompt section telling the model the PDF is already loaded, with its fields."""
+    count = len(session.fields)
+    if count > BOOTSTRAP_MAX_FIELDS:
+        return f"""
+## Form Already Loaded
+The PDF is already loaded ({count} fields). Do NOT call load_pdf.
+The form is too large to list here: use search_fields (or list_all_fields) to find fields.
+"""
+    return f"""
+## Form Already Loaded
+The PDF is already loaded. Do NOT call load_pdf or list_all_fields - all {count} fields are listed below.
+
+{_format_field_inventory(session)}
+"""
+
+
 
 
 # ============================================================================
@@ -466,30 +762,8 @@ if AGENT_SDK_AVAILABLE:
         if not session:
             return {"content": [{"type": "text", "text": '{"error": "No active session"}'}]}
 
-        pdf_path = args["pdf_path"]
-        print(f"[load_pdf] Loading: {pdf_path} (session: {session.session_id})")
-        try:
-            session.doc = fitz.open(pdf_path)
-            session.pdf_path = pdf_path
-
-            with open(pdf_path, 'rb') as f:
-                pdf_bytes = f.read()
-            session.fields = detect_form_fields(pdf_bytes)
-            session.pending_edits = {}
-            # Don't clear applied_edits if this is a continuation
-            if not session.is_continuation:
-                session.applied_edits = {}
-
-            result = {
-                "success": True,
-                "message": f"Loaded PDF with {len(session.fields)} form fields",
-                "field_count": len(session.fields)
-            }
-            print(f"[load_pdf] Success: {len(session.fields)} fields found")
-        except Exception as e:
-            result = {"success": False, "error": str(e)}
-            print(f"[load_pdf] Error: {e}")
-
+        # Detection (and label generation on a cache miss) runs off the event loop
+        result = await asyncio.to_thread(load_pdf_into_session, session, args["pdf_path"])
         return {"content": [{"type": "text", "text": json.dumps(result, indent=2)}]}
 
     @tool("list_all_fields", "List all form fields in the loaded PDF", {})
@@ -499,52 +773,24 @@ if AGENT_SDK_AVAILABLE:
         if not session or not session.doc:
             return {"content": [{"type": "text", "text": '{"error": "No PDF loaded. Call load_pdf first."}'}]}
 
-        fields = []
-        for f in session.fields:
-            field_info = {
-                "field_id": f.field_id,
-                "type": f.field_type.value,
-                "page": f.page,
-                "label": f.friendly_label or f.label_context[:100],
-                "has_options": f.options is not None,
-            }
-            # Include current value if the field has been filled
-            if f.field_id in session.applied_edits:
-                field_info["current_value"] = session.applied_edits[f.field_id]
-            elif f.current_value:
-                field_info["current_value"] = f.current_value
-            fields.append(field_info)
-
-        return {"content": [{"type": "text", "text": json.dumps(fields, indent=2)}]}
-
-    @tool("search_fields", "Search for fields matching a query", {"query": str})
+        return {"content": [{"type": "text", "text": _format_field_inventory(session)}]}
+
+    @tool("search_fields", "Search for fields matching a query (best matches first, top 10)", {"query": str})
     async def tool_search_fields(args: dict[str, Any]) -> dict[str, Any]:
-        """Search fields by label context."""
+        """Search fields by label, native name and context, ranked by relevance."""
         session = get_current_session()
         if not session or not session.doc:
             return {"content": [{"type": "text", "text": '{"error": "No PDF loaded."}'}]}
 
-        query = args["query"].lower()
-        results = []
-
-        for f in session.fields:
-            # Search in both friendly_label and label_context
-            friendly_lower = (f.friendly_label or "").lower()
-            context_lower = f.label_context.lower()
-            if query in friendly_lower or query in context_lower or any(word in friendly_lower or word in context_lower for word in query.split()):
-                field_info = {
-                    "field_id": f.field_id,
-                    "type": f.field_type.value,
-                    "page": f.page,
-                    "label": f.friendly_label or f.label_context[:150],
-                    "options": f.options,
-                }
-                # Include current value if set
-                if f.field_id in session.applied_edits:
-                    field_info["current_value"] = session.applied_edits[f.field_id]
-                results.append(field_info)
-
-        return {"content": [{"type": "text", "text": json.dumps(results[:10], indent=2)}]}
+        # BM25 over labels, native names and nearby text; best matches first
+        matches = session.search_index.search(args["query"], limit=10)
+        rows = [_field_row(session, f) + [f"{score:.2f}"] for f, score in matches]
+        table = format_field_table(
+            f"{len(rows)} matches for {args['query']!r}",
+            ["id", "type", "label", "value", "options", "score"],
+            rows,
+        )
+        return {"content": [{"type": "text", "text": table}]}
 
     @tool("get_field_details", "Get detailed info about a specific field", {"field_id": str})
     async def tool_get_field_details(args: dict[str, Any]) -> dict[str, Any]:
@@ -554,7 +800,7 @@ if AGENT_SDK_AVAILABLE:
             return {"content": [{"type": "text", "text": '{"error": "No PDF loaded."}'}]}
 
         field_id = args["field_id"]
-        field = next((f for f in session.fields if f.field_id == field_id), None)
+        field = session.get_field(field_id)
 
         if not field:
             return {"content": [{"type": "text", "text": f'{{"error": "Field not found: {field_id}"}}'}]}
@@ -570,6 +816,21 @@ if AGENT_SDK_AVAILABLE:
         }
         return {"content": [{"type": "text", "text": json.dumps(result, indent=2)}]}
 
+    def _stage_field_edit(session: FormFillingSession, field_id: str, value: Any) -> dict:
+        """Validate and stage one edit. Returns the per-field result."""
+        field = session.get_field(field_id)
+        if not field:
+            print(f"[set_field] Field not found: {field_id}")
+            return {"field_id": field_id, "error": f"Field not found: {field_id}"}
+
+        # Handle boolean for checkboxes
+        if field.field_type == FieldType.CHECKBOX:
+            if isinstance(value, str):
+                value = value.lower() in ('true', 'yes', '1', 'checked')
+
+        session.pending_edits[field_id] = value
+        return {"field_id": field_id, "value": value}
+
     @tool("set_field", "Stage a value for a field (call commit_edits to apply)", {"field_id": str, "value": str})
     async def tool_set_field(args: dict[str, Any]) -> dict[str, Any]:
         """Stage a field edit."""
@@ -578,26 +839,64 @@ if AGENT_SDK_AVAILABLE:
         if not session or not session.doc:
             return {"content": [{"type": "text", "text": '{"error": "No PDF loaded."}'}]}
 
-        field_id = args["field_id"]
-        value = args["value"]
+        staged = _stage_field_edit(session, args["field_id"], args["value"])
+        if "error" in staged:
+            return {"content": [{"type": "text", "text": json.dumps({"error": staged["error"]})}]}
+        print(f"[set_field] Staged: {staged['field_id']} = {staged['value']} (total pending: {len(session.pending_edits)})")
 
-        field = next((f for f in session.fields if f.field_id == field_id), None)
-        if not field:
-            print(f"[set_field] Field not found: {field_id}")
-            return {"content": [{"type": "text", "text": f'{{"error": "Field not found: {field_id}"}}'}]}
+        result = {
+            "success": True,
+            "field_id": staged["field_id"],
+            "value": staged["value"],
+            "pending_count": len(session.pending_edits)
+        }
+        return {"content": [{"type": "text", "text": json.dumps(result, indent=2)}]}
 
-        # Handle boolean for checkboxes
-        if field.field_type == FieldType.CHECKBOX:
-            if isinstance(value, str):
-                value = value.lower() in ('true', 'yes', '1', 'checked')
+    @tool(
+        "set_fields",
+        "Stage values for many fields in one call (call commit_edits to apply)",
+        {
+            "type": "object",
+            "properties": {
+                "edits": {
+                    "type": "array",
+                    "description": "Fields to stage",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "field_id": {"type": "string"},
+                            "value": {"type": "string"}
+                        },
+                        "required": ["field_id", "value"]
+                    }
+                }
+            },
+            "required": ["edits"]
+        }
+    )
+    async def tool_set_fields(args: dict[str, Any]) -> dict[str, Any]:
+        """Stage many field edits at once, reporting a status per item."""
+        session = get_current_session()
+        edits = args.get("edits") or []
+        print(f"[set_fields] Called with {len(edits)} edits")
+        if not session or not session.doc:
+            return {"content": [{"type": "text", "text": '{"error": "No PDF loaded."}'}]}
 
-        session.pending_edits[field_id] = value
-        print(f"[set_field] Staged: {field_id} = {value} (total pending: {len(session.pending_edits)})")
+        results = []
+        for edit in edits:
+            if not isinstance(edit, dict) or "field_id" not in edit or "value" not in edit:
+                results.append({"error": f"Invalid edit (needs field_id and value): {edit}"})
+                continue
+            results.append(_stage_field_edit(session, edit["field_id"], edit["value"]))
+
+        staged_count = sum(1 for r in results if "error" not in r)
+        print(f"[set_fields] Staged {staged_count}/{len(edits)} (total pending: {len(session.pending_edits)})")
 
         result = {
-            "success": True,
-            "field_id": field_id,
-            "value": value,
+            "success": staged_count == len(edits),
+            "staged_count": staged_count,
+            "error_count": len(edits) - staged_count,
+            "results": results,
             "pending_count": len(session.pending_edits)
         }
         return {"content": [{"type": "text", "text": json.dumps(result, indent=2)}]}
@@ -609,18 +908,18 @@ if AGENT_SDK_AVAILABLE:
         if not session:
             return {"content": [{"type": "text", "text": '{"error": "No active session"}'}]}
 
-        edits = []
+        rows = []
         for field_id, value in session.pending_edits.items():
-            field = next((f for f in session.fields if f.field_id == field_id), None)
-            edits.append({
-                "field_id": field_id,
-                "value": value,
-                "label": (field.friendly_label or field.label_context[:80]) if field else "unknown",
-                "type": field.field_type.value if field else "unknown",
-            })
-
-        result = {"pending_edits": edits, "count": len(edits)}
-        return {"content": [{"type": "text", "text": json.dumps(result, indent=2)}]}
+            field = session.get_field(field_id)
+            rows.append([
+                field_id,
+                _TYPE_CODES.get(field.field_type, field.field_type.value) if field else "?",
+                _cell(field.friendly_label or field.label_context, 80) if field else "unknown",
+                _cell(value),
+            ])
+
+        table = format_field_table(f"{len(rows)} pending edits", ["id", "type", "label", "value"], rows)
+        return {"content": [{"type": "text", "text": table}]}
 
     @tool(
         "commit_edits",
@@ -646,78 +945,7 @@ if AGENT_SDK_AVAILABLE:
         if not session.doc:
             return {"content": [{"type": "text", "text": '{"error": "No PDF loaded."}'}]}
 
-        output_path = args.get("output_path") or session.output_path
-        if not output_path:
-            output_path = session.pdf_path.replace('.pdf', '_filled.pdf')
-
-        print(f"[commit_edits] Saving to: {output_path}")
-
-        applied = []
-        errors = []
-
-        for field_id, value in session.pending_edits.items():
-            field = next((f for f in session.fields if f.field_id == field_id), None)
-            if not field:
-                errors.append(f"Field not found: {field_id}")
-                continue
-
-            try:
-                page = session.doc[field.page]
-                for widget in page.widgets():
-                    widget_field_id = f"page{field.page}_{widget.field_name}"
-                    if widget_field_id == field_id:
-                        if field.field_type == FieldType.CHECKBOX:
-                            widget.field_value = bool(value)
-                        else:
-                            str_value = str(value)
-                            if str_value:
-                                widget.field_value = str_value
-                            else:
-                                # PyMuPDF bug: empty strings don't persist after save
-                                # Use a single space as workaround for "clearing" fields
-                                print(f"[commit_edits] Clearing field {field_id} (was: {widget.field_value})")
-                                widget.field_value = " "
-                        widget.update()
-                        applied.append({"field_id": field_id, "value": value})
-                        session.applied_edits[field_id] = value
-                        print(f"[commit_edits] Applied: {field_id} = {value}")
-                        break
-            except Exception as e:
-                errors.append(f"Failed to apply {field_id}: {str(e)}")
-                print(f"[commit_edits] Error: {e}")
-
-        # Save
-        try:
-            session.doc.save(output_path)
-            print(f"[commit_edits] Saved successfully to: {output_path}")
-
-            # Store the filled PDF bytes for multi-turn
-            with open(output_path, 'rb') as f:
-                session.current_pdf_bytes = f.read()
-
-            # Verify file was created
-            import os
-            if os.path.exists(output_path):
-                file_size = os.path.getsize(output_path)
-                print(f"[commit_edits] File verified: {file_size} bytes")
-            else:
-                print(f"[commit_edits] WARNING: File not found after save!")
-                errors.append("File not created after save")
-        except Exception as e:
-            print(f"[commit_edits] Save error: {e}")
-            errors.append(f"Save failed: {str(e)}")
-
-        session.pending_edits.clear()
-
-        result = {
-            "success": len(errors) == 0,
-            "applied": applied,
-            "applied_count": len(applied),
-            "total_fields_filled": len(session.applied_edits),
-            "errors": errors,
-            "output_path": output_path
-        }
-        print(f"[commit_edits] Result: {result}")
+        result = await commit_pending_edits(session, args.get("output_path"))
         return {"content": [{"type": "text", "text": json.dumps(result, indent=2)}]}
 
     # Create the list of tools
@@ -727,6 +955,7 @@ if AGENT_SDK_AVAILABLE:
         tool_search_fields,
         tool_get_field_details,
         tool_set_field,
+        tool_set_fields,
         tool_get_pending_edits,
         tool_commit_edits,
     ]
@@ -743,90 +972,86 @@ SYSTEM_PROMPT = """You are a form-filling agent. Your job is to fill out PDF for
 ## Available Tools:
 - load_pdf: Load a PDF file
 - list_all_fields: See all form fields (includes current values if already filled)
-- search_fields: Find fields matching a query
+- search_fields: Find the fields best matching a query (ranked, top 10)
 - get_field_details: Get details about a specific field
-- set_field: Stage a value for a field
+- set_fields: Stage values for many fields in ONE call
+- set_field: Stage a value for a single field
 - get_pending_edits: Review staged edits
 - commit_edits: Apply all edits and save
 
 ## Workflow:
+(If the request says the form is already loaded, skip steps 1-2 and use the fields it lists.)
 1. Call load_pdf with the PDF path
 2. Call list_all_fields to see all fields (and their current values if this is a continuation)
-3. For each value to fill or update:
-   a. Search for the matching field if needed
-   b. Call set_field to stage the edit
-4. Call get_pending_edits to review
-5. Call commit_edits with the output path to save
+3. Work out every value to fill or update (search for fields if needed)
+4. Call set_fields ONCE with all of them: {"edits": [{"field_id": ..., "value": ...}, ...]}
+5. Fix any items that set_fields reported as errors
+6. Call commit_edits with the output path to save
 
-## IMPORTANT - Parallel Tool Use:
-For maximum efficiency, when you need to set multiple fields, call set_field for ALL of them simultaneously in parallel rather than one at a time. This dramatically speeds up form filling.
+## IMPORTANT - Batch Your Edits:
+Each tool call is a full round-trip, so stage all fields with a single set_fields call instead of one set_field call per field.
 
-Example: If filling name, email, and phone, make 3 parallel set_field calls at once, not 3 sequential calls.
+Example: If filling name, email, and phone, make 1 set_fields call with 3 edits, not 3 set_field calls.
 
 ## Multi-Turn Editing:
 When continuing from a previous session:
 - The PDF path provided is the ALREADY FILLED form from the previous turn
-- Fields will show their current_value from previous edits
+- Field listings show values from previous edits in the value column
 - Only modify the specific fields the user mentions
 - Don't re-fill fields that were already correctly filled unless asked
 
 ## Rules:
-- For dropdowns, use exact option values
+- For dropdowns, use exact option values (get_field_details has the full list when a listing shows "+N more")
 - For checkboxes, use "true" or "false"
-- Always review with get_pending_edits before committing
-- ALWAYS use parallel tool calls when setting multiple fields
+- set_fields reports a status per edit; only re-check the ones that failed
+- ALWAYS use set_fields when setting more than one field
 - When continuing, preserve existing values unless explicitly asked to change them
 """
 
-CONTINUATION_SYSTEM_PROMPT = """You are a form-filling agent continuing a multi-turn conversation.
-
-## Context:
-- The user has ALREADY filled out this form in a previous turn
-- The PDF you're loading contains the PREVIOUSLY FILLED values
-- You should ONLY modify the fields the user specifically asks about
-- All other fields should remain unchanged
+def _reference_documents_section(context_files: list | None) -> str:
+    """System prompt section holding the user's parsed context files."""
+    if not context_files:
+        return ""
+    context_parts = []
+    for cf in context_files:
+        filename = cf.get("filename", "unknown") if isinstance(cf, dict) else getattr(cf, "filename", "unknown")
+        content = cf.get("content", "") if isinstance(cf, dict) else getattr(cf, "content", "")
+        context_parts.append(f"### {filename}\n{content}")
+    return f"""
+## Reference Documents
+The user has provided the following documents as context for filling out the form. Use information from these documents to fill the form fields accurately.
 
-## Available Tools:
-- load_pdf: Load the already-filled PDF
-- list_all_fields: See all fields WITH their current values
-- search_fields: Find fields matching a query
-- get_field_details: Get details about a specific field (shows current value)
-- set_field: Stage a new value for a field
-- get_pending_edits: Review staged edits
-- commit_edits: Apply changes and save
-
-## Workflow for Continuation:
-1. Load the PDF (it already has previous values)
-2. List fields to see what's currently filled
-3. ONLY set_field for the specific fields the user wants to change
-4. Review and commit
-
-## CRITICAL:
-- Do NOT re-set fields that the user didn't ask to change
-- The form already has values - you're making INCREMENTAL updates
-- Only modify what the user explicitly requests
+{chr(10).join(context_parts)}
 """
 
 
-def _create_agent_options(
-    session: FormFillingSession,
-    output_path: str | None = None,
-    is_continuation: bool = False,
+def build_system_prompt(session: FormFillingSession) -> str:
+    """
+    System prompt for a run: the fixed instructions followed by the session's
+    reference documents.
+
+    Everything here stays byte-identical across the turns of a session (and
+    across sessions sharing the same documents), so together with the tool
+    definitions it forms a prefix the API can serve from the prompt cache.
+    Per-request details (paths, instructions, field inventory) belong in the
+    user prompt instead.
+    """
+    return SYSTEM_PROMPT + _reference_documents_section(session.context_files)
+
+
+def _build_agent_options(
+    system_prompt: str,
     resume_session_id: str | None = None,
+    anthropic_api_key: str | None = None,
 ) -> "ClaudeAgentOptions":
     """
     Create agent options with form-filling tools.
 
     Args:
-        session: The FormFillingSession for this request
-        output_path: Where to save the filled PDF
-        is_continuation: Whether this is a follow-up message in a conversation
+        system_prompt: System prompt for the conversation (see build_system_prompt)
         resume_session_id: Session ID from previous turn to resume conversation context
+        anthropic_api_key: User-provided key passed to the CLI process (else the server's)
     """
-    # Store output path in session for tools to access
-    session.output_path = output_path
-    session.is_continuation = is_continuation
-
     # Create in-process MCP server with our tools
     form_server = create_sdk_mcp_server(
         name="form-filler",
@@ -834,9 +1059,6 @@ def _create_agent_options(
         tools=FORM_TOOLS
     )
 
-    # Use different system prompt for continuations
-    system_prompt = CONTINUATION_SYSTEM_PROMPT if is_continuation else SYSTEM_PROMPT
-
     return ClaudeAgentOptions(
         system_prompt=system_prompt,
         mcp_servers={"forms": form_server},
@@ -846,14 +1068,67 @@ def _create_agent_options(
             "mcp__forms__search_fields",
             "mcp__forms__get_field_details",
             "mcp__forms__set_field",
+            "mcp__forms__set_fields",
             "mcp__forms__get_pending_edits",
             "mcp__forms__commit_edits",
         ],
         # Resume from previous session to maintain conversation context
         resume=resume_session_id,
+        env={"ANTHROPIC_API_KEY": anthropic_api_key} if anthropic_api_key else {},
     )
 
 
+# ============================================================================
+# Client Pool
+# ============================================================================
+
+def _pooled_client_factory(key: tuple[str, str | None], resume_session_id: str | None):
+    """
+    Build a client for the pool. Runs in the client's owner task, so the slot
+    set here is what the client's tools see through get_current_session().
+    """
+    system_prompt, anthropic_api_key = key
+    slot = _SessionSlot()
+    _session_slot.set(slot)
+    options = _build_agent_options(system_prompt, resume_session_id, anthropic_api_key)
+    return ClaudeSDKClient(options=options), slot
+
+
+_client_pool = ClientPool(_pooled_client_factory)
+
+
+def _pool_key(session: FormFillingSession) -> tuple[str, str | None]:
+    """Everything fixed when a client connects: the system prompt and the credentials."""
+    return (build_system_prompt(session), session.anthropic_api_key)
+
+
+def start_client_pool():
+    """Connect warm spares for the default configuration (no context files, server key)."""
+    if AGENT_SDK_AVAILABLE:
+        _client_pool.warm((SYSTEM_PROMPT, None))
+
+
+def warm_client_pool(anthropic_api_key: str | None):
+    """
+    Keep a spare connected for a user's own API key, so their next new
+    conversation doesn't pay the connect cost. The key is fixed when the CLI
+    starts, so the server-key spares can't serve it. Spares for a key are
+    dropped once it has been unused for AGENT_POOL_IDLE_TIMEOUT.
+    """
+    if AGENT_SDK_AVAILABLE and anthropic_api_key:
+        _client_pool.warm((SYSTEM_PROMPT, anthropic_api_key), expires=True)
+
+
+async def stop_client_pool():
+    """Disconnect every pooled client."""
+    await _client_pool.close()
+
+
+def get_client_pool_stats() -> dict:
+    """Lease and idle counters for the client pool."""
+    return _client_pool.stats()
+
+
 def _serialize_message(message) -> dict:
     """Convert an agent message to a JSON-serializable dict with user-friendly info."""
     msg_dict = {"type": "unknown"}
@@ -954,6 +1229,20 @@ def _get_friendly_tool_description(tool_name: str, tool_input: dict) -> str:
         else:
             return f"Setting field to '{value_preview}'"
 
+    elif tool_name == "mcp__forms__set_fields" or tool_name == "set_fields":
+        edits = tool_input.get("edits") or []
+        parts = []
+        for edit in edits[:3]:
+            if not isinstance(edit, dict):
+                continue
+            value = str(edit.get("value", ""))
+            value_preview = value[:25] + "..." if len(value) > 25 else value
+            field_label = _get_field_label(edit.get("field_id", ""))
+            parts.append(f"**{field_label}**: '{value_preview}'" if field_label else f"'{value_preview}'")
+        if len(edits) > 3:
+            parts.append(f"and {len(edits) - 3} more")
+        return f"Setting {len(edits)} fields: " + ", ".join(parts) if parts else f"Setting {len(edits)} fields..."
+
     elif tool_name == "mcp__forms__get_pending_edits" or tool_name == "get_pending_edits":
         return "Reviewing changes..."
 
@@ -969,7 +1258,7 @@ def _get_field_label(field_id: str) -> str:
     if not session or not session.fields:
         return None
 
-    field = next((f for f in session.fields if f.field_id == field_id), None)
+    field = session.get_field(field_id)
     if not field:
         return None
 
@@ -1045,16 +1334,26 @@ def _parse_tool_result_friendly(content) -> str:
                 if hasattr(item, "content"):
                     text = item.content
                     if isinstance(text, str):
-                        data = json.loads(text)
-                        return _format_tool_result(data)
+                        return _format_tool_text(text)
         elif isinstance(content, str):
-            data = json.loads(content)
-            return _format_tool_result(data)
+            return _format_tool_text(content)
     except:
         pass
     return None
 
 
+def _format_tool_text(text: str) -> str:
+    """Format a tool result that is either JSON or a compact field table."""
+    if text.lstrip().startswith(("{", "[")):
+        return _format_tool_result(json.loads(text))
+    # Compact tables start with a "<count> <what>" title line
+    title = text.split("\n", 1)[0]
+    match = re.match(r"(\d+) pending edits$", title)
+    if match and int(match.group(1)):
+        return f"Ready to apply {match.group(1)} changes"
+    return None
+
+
 def _format_tool_result(data: dict) -> str:
     """Format tool result data into user-friendly text."""
     if not isinstance(data, dict):
@@ -1071,6 +1370,14 @@ def _format_tool_result(data: dict) -> str:
         pending = data.get("pending_count", 0)
         return f"Queued: '{value}' ({pending} changes pending)"
 
+    # Fields set in bulk
+    if "staged_count" in data and "pending_count" in data:
+        staged = data.get("staged_count", 0)
+        errors = data.get("error_count", 0)
+        pending = data.get("pending_count", 0)
+        failed = f", {errors} failed" if errors else ""
+        return f"Queued {staged} values{failed} ({pending} changes pending)"
+
     # Edits committed
     if "applied_count" in data:
         count = data.get("applied_count", 0)
@@ -1079,15 +1386,122 @@ def _format_tool_result(data: dict) -> str:
             return f"Applied {count} changes ({total} total fields filled)"
         return f"Applied {count} field changes"
 
-    # Pending edits review
-    if "pending_edits" in data:
-        edits = data.get("pending_edits", [])
-        if edits:
-            return f"Ready to apply {len(edits)} changes"
-
     return None
 
 
+# ============================================================================
+# Run Budgets
+# ============================================================================
+
+# Wall-clock limit for one agent run, in seconds (0 disables)
+AGENT_RUN_TIMEOUT = float(os.environ.get("AGENT_RUN_TIMEOUT", "300"))
+# Seconds to wait for the CLI to acknowledge an interrupt after a budget runs out
+_INTERRUPT_GRACE_SECONDS = 5.0
+
+
+class RunBudget:
+    """
+    Turn and wall-clock limits for one agent run.
+
+    An iteration is one model response (assistant messages sharing a
+    message_id count once), so max_iterations bounds the tool-call round trips.
+    """
+    def __init__(self, max_iterations: int | None = None, timeout: float | None = AGENT_RUN_TIMEOUT):
+        self.max_iterations = max_iterations if max_iterations and max_iterations > 0 else None
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout if timeout else None
+        self.iterations = 0
+        self._message_ids: set[str] = set()
+        # "max_iterations" or "timeout" once a limit is hit
+        self.exceeded: str | None = None
+
+    def remaining(self) -> float | None:
+        """Seconds left before the deadline (None when unbounded)."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def count(self, message) -> bool:
+        """Record a message; returns False once it starts an iteration past the limit."""
+        if not (AssistantMessage and isinstance(message, AssistantMessage)):
+            return True
+        message_id = getattr(message, "message_id", None) or id(message)
+        if message_id in self._message_ids:
+            return True
+        self._message_ids.add(message_id)
+        self.iterations += 1
+        if self.max_iterations is not None and self.iterations > self.max_iterations:
+            self.exceeded = "max_iterations"
+            return False
+        return True
+
+    def to_event(self, auto_commit: dict | None) -> dict:
+        """The budget_exceeded event sent to the client."""
+        limit = (f"{self.max_iterations} iterations" if self.exceeded == "max_iterations"
+                 else f"{self.deadline - self.started:g}s")
+        applied = auto_commit.get("applied_count", 0) if auto_commit else 0
+        return {
+            "type": "budget_exceeded",
+            "reason": self.exceeded,
+            "iterations": self.iterations,
+            "elapsed_seconds": round(self.elapsed(), 1),
+            "auto_committed": applied,
+            "message": f"Stopped after reaching the {limit} limit"
+                       + (f"; applied {applied} staged changes" if applied else ""),
+        }
+
+
+async def _receive_within_budget(client, budget: RunBudget):
+    """
+    receive_response() that stops early when the budget runs out.
+
+    The message that would start an iteration past max_iterations is not
+    yielded. Sets budget.exceeded when stopping early.
+    """
+    responses = client.receive_response().__aiter__()
+    while True:
+        try:
+            message = await asyncio.wait_for(anext(responses), budget.remaining())
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError:
+            budget.exceeded = "timeout"
+            return
+        if not budget.count(message):
+            return
+        yield message
+
+
+async def _stop_over_budget(client, session: FormFillingSession) -> tuple[dict | None, str | None]:
+    """
+    Interrupt the CLI after a budget ran out and commit whatever was staged.
+
+    Returns:
+        (commit result or None, session_id from the interrupted run if reported)
+    """
+    agent_session_id = None
+    try:
+        await asyncio.wait_for(client.interrupt(), _INTERRUPT_GRACE_SECONDS)
+
+        async def drain():
+            async for message in client.receive_response():
+                if ResultMessage and isinstance(message, ResultMessage):
+                    return getattr(message, "session_id", None)
+
+        agent_session_id = await asyncio.wait_for(drain(), _INTERRUPT_GRACE_SECONDS)
+    except Exception as e:
+        print(f"[Budget] Interrupt did not complete cleanly: {e}")
+
+    commit_result = None
+    if session.doc and session.pending_edits:
+        print(f"[Budget] Auto-committing {len(session.pending_edits)} staged edits")
+        commit_result = await commit_pending_edits(session)
+    return commit_result, agent_session_id
+
+
 # ============================================================================
 # Main Agent Functions
 # ============================================================================
@@ -1103,6 +1517,10 @@ async def run_agent_stream(
     original_pdf_bytes: bytes | None = None,
     context_files: list | None = None,
     anthropic_api_key: str | None = None,
+    persist_output: bool = True,
+    bootstrap: bool = True,
+    max_iterations: int | None = None,
+    timeout: float | None = AGENT_RUN_TIMEOUT,
 ):
     """
     Run the agent and yield messages as they come in (for streaming).
@@ -1121,6 +1539,13 @@ async def run_agent_stream(
         original_pdf_bytes: The original (unfilled) PDF bytes for first-turn sessions
         context_files: List of parsed context files (dicts with filename, content, was_parsed)
         anthropic_api_key: User-provided Anthropic API key for Claude calls
+        persist_output: Write each commit to output_path. When False the filled
+            PDF is only kept in memory (session.current_pdf_bytes)
+        bootstrap: Load the PDF and embed its field inventory in the prompt before
+            the model starts, instead of spending turns on load_pdf/list_all_fields
+        max_iterations: Most model responses before the run is stopped (None = unlimited)
+        timeout: Wall-clock seconds before the run is stopped (None/0 = unlimited).
+            A stopped run commits its staged edits and reports budget_exceeded
 
     Yields:
         dict: Serialized message from the agent, including session_id in complete event
@@ -1132,6 +1557,7 @@ async def run_agent_stream(
         yield {"type": "error", "error": f"Claude Agent SDK not available: {AGENT_SDK_ERROR}"}
         return
 
+    budget = RunBudget(max_iterations, timeout)
     pdf_path = str(Path(pdf_path).resolve())
     if output_path:
         output_path = str(Path(output_path).resolve())
@@ -1140,6 +1566,9 @@ async def run_agent_stream(
     session = _session_manager.get_or_create_session(user_session_id)
     # Set it as the current session in context for tools to access
     set_current_session(session)
+    session.persist_output = persist_output
+    # Request-scoped credentials: read by label generation and the pooled client key
+    session.anthropic_api_key = anthropic_api_key
 
     # Reset session appropriately
     if is_continuation:
@@ -1157,25 +1586,15 @@ async def run_agent_stream(
     if context_files:
         session.context_files = context_files
 
-    # Build context files section if available - ONLY for first turn
-    # For continuations, context is already in conversation history via session resumption
-    context_section = ""
-    if not is_continuation:
-        all_context_files = session.context_files or []
-        if all_context_files:
-            context_parts = []
-            for cf in all_context_files:
-                filename = cf.get("filename", "unknown") if isinstance(cf, dict) else getattr(cf, "filename", "unknown")
-                content = cf.get("content", "") if isinstance(cf, dict) else getattr(cf, "content", "")
-                context_parts.append(f"### {filename}\n{content}")
-            context_section = f"""
-## Reference Documents
-The user has provided the following documents as context for filling out the form. Use information from these documents to fill the form fields accurately.
-
-{chr(10).join(context_parts)}
-
----
-"""
+    # Preload the PDF so the model can start editing on its first turn
+    bootstrap_section = ""
+    if bootstrap:
+        session.is_continuation = is_continuation
+        yield {"type": "status", "message": "Loading PDF..."}
+        load_result = await asyncio.to_thread(load_pdf_into_session, session, pdf_path)
+        if load_result.get("success"):
+            bootstrap_section = _bootstrap_prompt_section(session)
+            yield {"type": "status", "message": load_result["message"]}
 
     # Build prompt based on whether this is a continuation
     if is_continuation:
@@ -1196,33 +1615,35 @@ Previous fields that were filled:
 {edits_summary if edits_summary else "(see current values in list_all_fields)"}
 
 User's NEW request: {instructions}
-
+{bootstrap_section}
 IMPORTANT: The PDF already contains values from the previous turn.
-Load it, check what's already filled, then ONLY change the specific fields the user is asking about.
+{"Check" if bootstrap_section else "Load it, check"} what's already filled, then ONLY change the specific fields the user is asking about.
 Do NOT re-fill fields unless the user specifically asks to change them."""
 
     else:
         prompt = f"""Please fill out this PDF form:
-{context_section}
+
 PDF Path: {pdf_path}
 Output Path: {output_path or pdf_path.replace('.pdf', '_filled.pdf')}
 
 Instructions: {instructions}
-
-Start by loading the PDF, then list the fields, fill them according to the instructions, and commit the edits."""
+{bootstrap_section}
+{"Fill the fields according to the instructions with set_fields, then commit the edits." if bootstrap_section else "Start by loading the PDF, then list the fields, fill them according to the instructions, and commit the edits."}"""
 
     # Log prompt size breakdown for debugging token usage
-    context_chars = len(context_section)
+    system_chars = len(build_system_prompt(session))
     prompt_chars = len(prompt)
-    estimated_context_tokens = context_chars // 4  # rough estimate
+    estimated_system_tokens = system_chars // 4  # rough estimate
     estimated_prompt_tokens = prompt_chars // 4
-    print(f"[Prompt Size] Context section: {context_chars} chars (~{estimated_context_tokens} tokens)")
-    print(f"[Prompt Size] Full prompt: {prompt_chars} chars (~{estimated_prompt_tokens} tokens)")
+    print(f"[Prompt Size] System prompt (cacheable, incl. context): {system_chars} chars (~{estimated_system_tokens} tokens)")
+    print(f"[Prompt Size] Request prompt: {prompt_chars} chars (~{estimated_prompt_tokens} tokens)")
 
-    print(f"[Agent Stream] Creating ClaudeSDKClient...")
+    print(f"[Agent Stream] Leasing ClaudeSDKClient...")
     yield {"type": "status", "message": "Connecting to Claude Agent SDK..."}
 
-    options = _create_agent_options(session, output_path, is_continuation, resume_session_id)
+    # Store output path in session for tools to access
+    session.output_path = output_path
+    session.is_continuation = is_continuation
     message_count = 0
     result_text = ""
     agent_session_id = None  # Will be extracted from ResultMessage
@@ -1232,22 +1653,24 @@ Start by loading the PDF, then list the fields, fill them according to the instr
     total_output_tokens = 0
     turn_input_tokens = 0
     turn_output_tokens = 0
+    cache_read_tokens = 0
+    cache_creation_tokens = 0
 
-    # Set API key in environment if provided (for Claude SDK to use)
-    import os as os_module
-    original_api_key = os_module.environ.get("ANTHROPIC_API_KEY")
     if anthropic_api_key:
-        os_module.environ["ANTHROPIC_API_KEY"] = anthropic_api_key
         print(f"[Agent Stream] Using user-provided Anthropic API key")
+        warm_client_pool(anthropic_api_key)
 
     try:
-        async with ClaudeSDKClient(options=options) as client:
+        # A continuation is served by the client still holding its conversation when possible
+        async with _client_pool.lease(_pool_key(session), resume_session_id) as pooled:
+            pooled.slot.session = session
+            client = pooled.client
             print(f"[Agent Stream] Connected, sending query...")
             yield {"type": "status", "message": "Agent connected, processing..."}
 
             await client.query(prompt)
 
-            async for message in client.receive_response():
+            async for message in _receive_within_budget(client, budget):
                 message_count += 1
                 msg_type = type(message).__name__
 
@@ -1289,31 +1712,40 @@ Start by loading the PDF, then list the fields, fill them according to the instr
                     turn_output_tokens = msg_output
                     total_input_tokens = total_input
                     total_output_tokens = msg_output
+                    cache_read_tokens = cache_read
+                    cache_creation_tokens = cache_creation
 
                     print(f"[Token Usage] input={msg_input}, cache_read={cache_read}, cache_creation={cache_creation}, output={msg_output}")
                     print(f"[Token Usage] Total input (incl. cache): {total_input}")
 
                 yield _serialize_message(message)
 
+            if budget.exceeded:
+                # Out of turns or time: stop the CLI, keep what was staged
+                print(f"[Agent Stream] Budget exceeded ({budget.exceeded}) after {budget.iterations} iterations")
+                commit_result, interrupted_session_id = await _stop_over_budget(client, session)
+                agent_session_id = agent_session_id or interrupted_session_id
+                yield budget.to_event(commit_result)
+            else:
+                # Keep the client for this conversation's next turn
+                pooled.conversation_id = agent_session_id
+
     except Exception as e:
         print(f"[Agent Stream] Error: {e}")
         import traceback
         traceback.print_exc()
         yield {"type": "error", "error": f"Agent error: {str(e)}"}
-    finally:
-        # Restore original API key
-        if anthropic_api_key:
-            if original_api_key:
-                os_module.environ["ANTHROPIC_API_KEY"] = original_api_key
-            elif "ANTHROPIC_API_KEY" in os_module.environ:
-                del os_module.environ["ANTHROPIC_API_KEY"]
 
     # Log token usage summary
     turn_type = "CONTINUATION" if is_continuation else "NEW SESSION"
     print(f"[Token Usage Summary] {turn_type} complete:")
     print(f"  Total input tokens (incl. cache): {total_input_tokens}")
+    print(f"  Cache read / creation tokens: {cache_read_tokens} / {cache_creation_tokens}")
     print(f"  Output tokens: {total_output_tokens}")
 
+    # Make sure the last commit has reached output_path before returning
+    await session.flush_output()
+
     # Save session state to database for persistence across server restarts
     _session_manager.save_session(session)
 
@@ -1327,11 +1759,15 @@ Start by loading the PDF, then list the fields, fill them according to the instr
         "applied_edits": dict(session.applied_edits),
         "session_id": agent_session_id,  # Return session_id for frontend to use in next turn
         "user_session_id": session.session_id,  # Return the user session ID for concurrent user tracking
+        "iterations": budget.iterations,
+        "budget_exceeded": budget.exceeded,
         "token_usage": {
             "turn_input_tokens": turn_input_tokens,
             "turn_output_tokens": turn_output_tokens,
             "total_input_tokens": total_input_tokens,
             "total_output_tokens": total_output_tokens,
+            "cache_read_input_tokens": cache_read_tokens,
+            "cache_creation_input_tokens": cache_creation_tokens,
         },
     }
 
@@ -1344,6 +1780,10 @@ async def run_agent(
     previous_edits: dict[str, Any] | None = None,
     user_session_id: str | None = None,
     anthropic_api_key: str | None = None,
+    persist_output: bool = True,
+    bootstrap: bool = True,
+    max_iterations: int | None = None,
+    timeout: float | None = AGENT_RUN_TIMEOUT,
 ) -> dict:
     """
     Run the form-filling agent using ClaudeSDKClient.
@@ -1356,6 +1796,13 @@ async def run_agent(
         previous_edits: Dict of field_id -> value from previous turns
         user_session_id: Unique ID for this user's form-filling session (for concurrent users)
         anthropic_api_key: User-provided Anthropic API key for Claude calls
+        persist_output: Write each commit to output_path. When False the filled
+            PDF is only kept in memory (session.current_pdf_bytes)
+        bootstrap: Load the PDF and embed its field inventory in the prompt before
+            the model starts, instead of spending turns on load_pdf/list_all_fields
+        max_iterations: Most model responses before the run is stopped (None = unlimited)
+        timeout: Wall-clock seconds before the run is stopped (None/0 = unlimited).
+            A stopped run commits its staged edits and reports budget_exceeded
 
     Returns:
         Summary of the agent execution
@@ -1363,6 +1810,7 @@ async def run_agent(
     if not AGENT_SDK_AVAILABLE:
         raise ValueError(f"Claude Agent SDK not available: {AGENT_SDK_ERROR}")
 
+    budget = RunBudget(max_iterations, timeout)
     pdf_path = str(Path(pdf_path).resolve())
     if output_path:
         output_path = str(Path(output_path).resolve())
@@ -1371,6 +1819,9 @@ async def run_agent(
     session = _session_manager.get_or_create_session(user_session_id)
     # Set it as the current session in context for tools to access
     set_current_session(session)
+    session.persist_output = persist_output
+    # Request-scoped credentials: read by label generation and the pooled client key
+    session.anthropic_api_key = anthropic_api_key
 
     # Reset session appropriately
     if is_continuation:
@@ -1380,6 +1831,14 @@ async def run_agent(
     else:
         session.reset()
 
+    # Preload the PDF so the model can start editing on its first turn
+    bootstrap_section = ""
+    if bootstrap:
+        session.is_continuation = is_continuation
+        load_result = await asyncio.to_thread(load_pdf_into_session, session, pdf_path)
+        if load_result.get("success"):
+            bootstrap_section = _bootstrap_prompt_section(session)
+
     if is_continuation:
         prompt = f"""This is a CONTINUATION of a form-filling session.
 
@@ -1387,8 +1846,8 @@ PDF Path (already filled): {pdf_path}
 Output Path: {output_path or pdf_path}
 
 User's NEW request: {instructions}
-
-Load the PDF, check current values, then ONLY change the fields the user asks about."""
+{bootstrap_section}
+{"Check" if bootstrap_section else "Load the PDF, check"} current values, then ONLY change the fields the user asks about."""
     else:
         prompt = f"""Please fill out this PDF form:
 
@@ -1396,39 +1855,39 @@ PDF Path: {pdf_path}
 Output Path: {output_path or pdf_path.replace('.pdf', '_filled.pdf')}
 
 Instructions: {instructions}
+{bootstrap_section}
+{"Fill the fields according to the instructions with set_fields, then commit the edits." if bootstrap_section else "Start by loading the PDF, then list the fields, fill them according to the instructions, and commit the edits."}"""
 
-Start by loading the PDF, then list the fields, fill them according to the instructions, and commit the edits."""
-
-    options = _create_agent_options(session, output_path, is_continuation)
+    # Store output path in session for tools to access
+    session.output_path = output_path
+    session.is_continuation = is_continuation
     messages = []
     result_text = ""
 
-    # Set API key in environment if provided (for Claude SDK to use)
-    import os as os_module
-    original_api_key = os_module.environ.get("ANTHROPIC_API_KEY")
     if anthropic_api_key:
-        os_module.environ["ANTHROPIC_API_KEY"] = anthropic_api_key
         print(f"[Agent] Using user-provided Anthropic API key")
+        warm_client_pool(anthropic_api_key)
 
-    try:
-        async with ClaudeSDKClient(options=options) as client:
-            await client.query(prompt)
+    async with _client_pool.lease(_pool_key(session)) as pooled:
+        pooled.slot.session = session
+        client = pooled.client
+        await client.query(prompt)
 
-            async for message in client.receive_response():
-                messages.append(message)
+        async for message in _receive_within_budget(client, budget):
+            messages.append(message)
 
-                if isinstance(message, AssistantMessage):
-                    for block in message.content:
-                        if isinstance(block, TextBlock):
-                            result_text = block.text
-                            print(f"  Agent: {result_text[:100]}...")
-    finally:
-        # Restore original API key
-        if anthropic_api_key:
-            if original_api_key:
-                os_module.environ["ANTHROPIC_API_KEY"] = original_api_key
-            elif "ANTHROPIC_API_KEY" in os_module.environ:
-                del os_module.environ["ANTHROPIC_API_KEY"]
+            if isinstance(message, AssistantMessage):
+                for block in message.content:
+                    if isinstance(block, TextBlock):
+                        result_text = block.text
+                        print(f"  Agent: {result_text[:100]}...")
+
+        if budget.exceeded:
+            print(f"[Agent] Budget exceeded ({budget.exceeded}) after {budget.iterations} iterations")
+            await _stop_over_budget(client, session)
+
+    # Make sure the last commit has reached output_path before returning
+    await session.flush_output()
 
     # Save session state to database for persistence across server restarts
     _session_manager.save_session(session)
@@ -1440,6 +1899,8 @@ Start by loading the PDF, then list the fields, fill them according to the instr
         "applied_count": len(session.applied_edits),
         "applied_edits": dict(session.applied_edits),
         "user_session_id": session.session_id,
+        "iterations": budget.iterations,
+        "budget_exceeded": budget.exceeded,
     }
 
 
@@ -0,0 +1,334 @@
+"""
+Batch (mail-merge) form filling.
+
+Fills one template PDF once per record in a CSV or JSONL file. Fields are
+detected once for the template, then the rows are filled in parallel across
+a process pool using edit_pdf_with_instructions. Each filled PDF is the
+template plus a small incremental update, so throughput is dominated by
+widget appearance generation rather than PDF serialization.
+
+Usage:
+    python batch_fill.py template.pdf rows.csv --out filled/
+    python batch_fill.py template.pdf rows.jsonl --zip filled.zip --workers 8
+
+Row keys may be field_ids (e.g. "page0_FirstName") or native PDF field
+names (e.g. "FirstName"). Empty values are skipped so blank CSV cells
+leave the template's value untouched.
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from pdf_processor import DetectedField, detect_form_fields, edit_pdf_with_instructions
+
+
+# Worker processes for filling rows (defaults to all cores)
+BATCH_FILL_WORKERS = int(os.environ.get("BATCH_FILL_WORKERS", os.cpu_count() or 1))
+# Rows sent to a worker per task; amortizes IPC without starving the pool
+BATCH_FILL_CHUNK_SIZE = int(os.environ.get("BATCH_FILL_CHUNK_SIZE", "16"))
+# Optional row column used as the output filename
+FILENAME_COLUMN = "_filename"
+
+
+# ============================================================================
+# Row Loading
+# ============================================================================
+
+def load_rows(data: bytes | str, filename: str = "") -> list[dict]:
+    """
+    Parse batch rows from CSV or JSONL.
+
+    The format is taken from the filename extension (.csv, .jsonl, .ndjson);
+    without one, content starting with "{" is treated as JSONL.
+    """
+    if isinstance(data, bytes):
+        data = data.decode("utf-8-sig")
+
+    ext = Path(filename).suffix.lower()
+    if ext in (".jsonl", ".ndjson") or (not ext and data.lstrip().startswith("{")):
+        rows = []
+        for line_num, line in enumerate(data.splitlines(), 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON on line {line_num}: {e}")
+            if not isinstance(row, dict):
+                raise ValueError(f"Line {line_num} is not a JSON object")
+            rows.append(row)
+        return rows
+
+    return list(csv.DictReader(io.StringIO(data)))
+
+
+def _resolve_row_keys(fields: list[DetectedField]) -> dict[str, str]:
+    """Map every accepted row key (field_id or native field name) to a field_id."""
+    key_map = {}
+    for f in fields:
+        if f.native_field_name:
+            key_map.setdefault(f.native_field_name, f.field_id)
+    for f in fields:
+        key_map[f.field_id] = f.field_id
+    return key_map
+
+
+def _row_to_edits(row: dict, key_map: dict[str, str]) -> list[dict]:
+    """Convert one row into edit_pdf_with_instructions edits, skipping empty/unknown keys."""
+    edits = []
+    for key, value in row.items():
+        if key is None or value is None or value == "":
+            continue
+        field_id = key_map.get(key.strip())
+        if field_id is None:
+            continue
+        if not isinstance(value, (str, bool)):
+            value = str(value)
+        edits.append({"field_id": field_id, "value": value})
+    return edits
+
+
+# ============================================================================
+# Parallel Filling
+# ============================================================================
+
+# Per-worker template state, set once by _init_fill_worker
+_worker_template: bytes | None = None
+_worker_fields: list[DetectedField] | None = None
+
+
+def _init_fill_worker(template_bytes: bytes, fields: list[DetectedField]):
+    """Process pool initializer: keep the template and its fields resident in the worker."""
+    global _worker_template, _worker_fields
+    _worker_template = template_bytes
+    _worker_fields = fields
+
+
+def _fill_chunk(chunk: list[tuple[int, list[dict]]]) -> list[tuple[int, bytes | None, str | None]]:
+    """Fill a chunk of rows in a worker. Returns (row_index, pdf_bytes, error) per row."""
+    results = []
+    for row_index, edits in chunk:
+        try:
+            results.append((row_index, edit_pdf_with_instructions(_worker_template, edits, _worker_fields), None))
+        except Exception as e:
+            results.append((row_index, None, str(e)))
+    return results
+
+
+def _chunked(items: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_filled_pdfs(
+    template_bytes: bytes,
+    rows: list[dict],
+    fields: list[DetectedField] | None = None,
+    workers: int = BATCH_FILL_WORKERS,
+    chunk_size: int = BATCH_FILL_CHUNK_SIZE,
+) -> Iterator[tuple[int, bytes | None, str | None]]:
+    """
+    Fill the template once per row, yielding results in row order.
+
+    Args:
+        template_bytes: The template PDF as bytes
+        rows: Records mapping field_id (or native field name) -> value
+        fields: Detected fields for the template (detected once if omitted)
+        workers: Worker processes; 1 fills in the calling process
+        chunk_size: Rows per worker task
+
+    Yields:
+        (row_index, filled_pdf_bytes, error) - bytes is None when error is set
+    """
+    if fields is None:
+        fields = detect_form_fields(template_bytes, generate_friendly_labels=False)
+    if not fields:
+        raise ValueError("No fillable form fields found in the template PDF")
+
+    key_map = _resolve_row_keys(fields)
+    jobs = ((i, _row_to_edits(row, key_map)) for i, row in enumerate(rows))
+
+    if workers <= 1:
+        _init_fill_worker(template_bytes, fields)
+        for chunk in _chunked(jobs, chunk_size):
+            yield from _fill_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_fill_worker,
+        initargs=(template_bytes, fields),
+    ) as pool:
+        # map() keeps results in submission order while workers run ahead
+        for results in pool.map(_fill_chunk, _chunked(jobs, chunk_size)):
+            yield from results
+
+
+def _output_name(row: dict, row_index: int, stem: str) -> str:
+    """Filename for a filled row: the row's _filename column, else <stem>_<index>.pdf."""
+    name = str(row.get(FILENAME_COLUMN) or "").strip()
+    if name:
+        name = Path(name).name
+        return name if name.lower().endswith(".pdf") else f"{name}.pdf"
+    return f"{stem}_{row_index + 1:05d}.pdf"
+
+
+def _unique_output_name(row: dict, row_index: int, stem: str, used_names: set[str]) -> str:
+    """
+    _output_name, suffixed with the row number when an earlier row already
+    took that name (rows sharing a _filename must not overwrite each other).
+    Records the chosen name in used_names.
+    """
+    name = _output_name(row, row_index, stem)
+    base = Path(name).stem
+    suffix = 0
+    while name in used_names:
+        suffix += 1
+        name = f"{base}_{row_index + 1:05d}.pdf" if suffix == 1 else f"{base}_{row_index + 1:05d}_{suffix}.pdf"
+    used_names.add(name)
+    return name
+
+
+# ============================================================================
+# Output
+# ============================================================================
+
+class _ZipChunkBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink that lets zipfile stream entries out in chunks."""
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_batch_zip(
+    template_bytes: bytes,
+    rows: list[dict],
+    template_name: str = "form.pdf",
+    fields: list[DetectedField] | None = None,
+    workers: int = BATCH_FILL_WORKERS,
+) -> Iterator[bytes]:
+    """
+    Fill every row and stream the results as a ZIP archive.
+
+    Entries are written as soon as their row is filled, so the first bytes go
+    out long before the batch finishes. Rows that fail are listed in
+    errors.json at the end of the archive.
+    """
+    stem = Path(template_name).stem or "form"
+    sink = _ZipChunkBuffer()
+    errors = []
+    used_names: set[str] = {"errors.json"}
+
+    # PDFs are mostly compressed streams already; storing keeps throughput CPU-bound on filling
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for row_index, pdf_bytes, error in iter_filled_pdfs(template_bytes, rows, fields, workers):
+            if error is not None:
+                errors.append({"row": row_index + 1, "error": error})
+                continue
+            archive.writestr(_unique_output_name(rows[row_index], row_index, stem, used_names), pdf_bytes)
+            yield sink.drain()
+
+        if errors:
+            archive.writestr("errors.json", json.dumps(errors, indent=2))
+    yield sink.drain()
+
+
+def fill_batch_to_directory(
+    template_bytes: bytes,
+    rows: list[dict],
+    out_dir: str | Path,
+    template_name: str = "form.pdf",
+    workers: int = BATCH_FILL_WORKERS,
+) -> dict:
+    """
+    Fill every row and write each PDF into out_dir.
+
+    Returns:
+        Summary dict with filled/failed counts, elapsed seconds and PDFs per second
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(template_name).stem or "form"
+
+    start = time.perf_counter()
+    filled = 0
+    errors = []
+    used_names: set[str] = {"errors.json"}
+    for row_index, pdf_bytes, error in iter_filled_pdfs(template_bytes, rows, workers=workers):
+        if error is not None:
+            errors.append({"row": row_index + 1, "error": error})
+            continue
+        (out_dir / _unique_output_name(rows[row_index], row_index, stem, used_names)).write_bytes(pdf_bytes)
+        filled += 1
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        (out_dir / "errors.json").write_text(json.dumps(errors, indent=2))
+
+    return {
+        "filled": filled,
+        "failed": len(errors),
+        "seconds": round(elapsed, 3),
+        "pdfs_per_second": round(filled / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fill one PDF template for every row of a CSV/JSONL file.")
+    parser.add_argument("template", help="Template PDF with AcroForm fields")
+    parser.add_argument("rows", help="CSV or JSONL file of field -> value records")
+    parser.add_argument("--out", help="Directory to write filled PDFs into")
+    parser.add_argument("--zip", dest="zip_path", help="Write a ZIP archive instead of a directory")
+    parser.add_argument("--workers", type=int, default=BATCH_FILL_WORKERS, help="Worker processes")
+    args = parser.parse_args()
+
+    if not args.out and not args.zip_path:
+        parser.error("one of --out or --zip is required")
+
+    template_path = Path(args.template)
+    rows_path = Path(args.rows)
+    template_bytes = template_path.read_bytes()
+    rows = load_rows(rows_path.read_bytes(), rows_path.name)
+    print(f"[Batch] {len(rows)} rows, {args.workers} workers")
+
+    if args.zip_path:
+        start = time.perf_counter()
+        with open(args.zip_path, "wb") as f:
+            for chunk in stream_batch_zip(template_bytes, rows, template_path.name, workers=args.workers):
+                f.write(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"[Batch] Wrote {args.zip_path} in {elapsed:.2f}s ({len(rows) / elapsed:.1f} PDFs/s)")
+    else:
+        summary = fill_batch_to_directory(template_bytes, rows, args.out, template_path.name, args.workers)
+        print(f"[Batch] Filled {summary['filled']} PDFs ({summary['failed']} failed) "
+              f"in {summary['seconds']}s ({summary['pdfs_per_second']} PDFs/s)")
+        if summary["failed"]:
+            sys.exit(1)
@@ -0,0 +1,324 @@
+"""
+Warm pool of connected ClaudeSDKClient instances.
+
+Connecting a ClaudeSDKClient spawns the Claude Code CLI and performs the
+initialize handshake, a fixed cost paid before the first token of every
+agent run. The pool takes that off the request path in two ways:
+
+1. Warm spares: a few clients for the default configuration are connected
+   ahead of time, so a fresh run leases one that is already up. The API key
+   is fixed when the CLI process starts, so users who bring their own key
+   get spares of their own (AGENT_POOL_KEY_SPARES each, for at most
+   AGENT_POOL_MAX_WARM_KEYS keys), dropped once the key goes quiet.
+2. Conversation reuse: after a run, its client is kept (tagged with the
+   conversation's session_id) so the next continuation turn picks the same
+   process back up instead of spawning a new one and resuming from disk.
+
+A client only ever holds one conversation, so spares are handed out to
+fresh runs only, and a used client is only handed back to the conversation
+it already holds. Clients are retired when unhealthy, after
+AGENT_POOL_MAX_USES runs, or after AGENT_POOL_IDLE_TIMEOUT seconds unused.
+
+The SDK requires connect() and disconnect() to happen in the same task, so
+each client is owned by a small background task that connects it, waits
+for it to be retired and then disconnects it. Requests only query and read.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Hashable
+
+
+# Warm spares kept connected for the default configuration (0 disables)
+AGENT_POOL_SIZE = int(os.environ.get("AGENT_POOL_SIZE", "2"))
+# Runs served by one client before it is retired (1 disables conversation reuse)
+AGENT_POOL_MAX_USES = int(os.environ.get("AGENT_POOL_MAX_USES", "8"))
+# Seconds a used client waits for its next turn before it is retired
+AGENT_POOL_IDLE_TIMEOUT = float(os.environ.get("AGENT_POOL_IDLE_TIMEOUT", "300"))
+# Upper bound on idle clients across all keys (oldest are retired first)
+AGENT_POOL_MAX_IDLE = int(os.environ.get("AGENT_POOL_MAX_IDLE", "32"))
+# Warm spares kept per user-supplied API key (0 disables per-key warming)
+AGENT_POOL_KEY_SPARES = int(os.environ.get("AGENT_POOL_KEY_SPARES", "1"))
+# User-supplied API keys kept warm at once (least recently used are dropped)
+AGENT_POOL_MAX_WARM_KEYS = int(os.environ.get("AGENT_POOL_MAX_WARM_KEYS", "16"))
+
+# Factory signature: (key, resume_session_id) -> (client, slot)
+ClientFactory = Callable[[Hashable, str | None], tuple[Any, Any]]
+
+
+class PooledClient:
+    """A connected client, the per-client slot its tools read, and its bookkeeping."""
+    def __init__(self, key: Hashable, client: Any, slot: Any):
+        self.key = key
+        self.client = client
+        self.slot = slot
+        self.uses = 0
+        # session_id of the conversation this client holds (None for a spare)
+        self.conversation_id: str | None = None
+        self.last_used = time.monotonic()
+        self._retire = asyncio.Event()
+        self._owner: asyncio.Task | None = None
+
+    def healthy(self) -> bool:
+        """True while the CLI process is running and the owner task is alive."""
+        if self._retire.is_set() or self._owner is None or self._owner.done():
+            return False
+        transport = getattr(self.client, "_transport", None)
+        if transport is None or not transport.is_ready():
+            return False
+        process = getattr(transport, "_process", None)
+        return process is None or process.returncode is None
+
+    def retire(self):
+        """Ask the owner task to disconnect the client."""
+        self._retire.set()
+
+
+class ClientPool:
+    """
+    Keyed pool of connected clients.
+
+    The key identifies everything fixed at connect time (system prompt,
+    credentials); the factory builds an unconnected client for a key. It is
+    called inside the owner task, so context variables it sets are inherited
+    by the client's reader tasks - which is how tools find their slot.
+    """
+    def __init__(
+        self,
+        factory: ClientFactory,
+        size: int = AGENT_POOL_SIZE,
+        max_uses: int = AGENT_POOL_MAX_USES,
+        idle_timeout: float = AGENT_POOL_IDLE_TIMEOUT,
+        max_idle: int = AGENT_POOL_MAX_IDLE,
+        key_spares: int = AGENT_POOL_KEY_SPARES,
+        max_warm_keys: int = AGENT_POOL_MAX_WARM_KEYS,
+    ):
+        self._factory = factory
+        self.size = size
+        self.max_uses = max_uses
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.key_spares = key_spares
+        self.max_warm_keys = max_warm_keys
+        self._idle: list[PooledClient] = []
+        # key -> number of spares to keep connected
+        self._spare_keys: dict[Hashable, int] = {}
+        # Expiring (per-user) warm keys -> last use, least recently used first
+        self._expiring: OrderedDict[Hashable, float] = OrderedDict()
+        self._spawning: dict[Hashable, int] = {}
+        self._reaper: asyncio.Task | None = None
+        self._stats = {"warm_leases": 0, "reused_leases": 0, "cold_leases": 0, "retired": 0}
+
+    # ------------------------------------------------------------------
+    # Client lifecycle
+    # ------------------------------------------------------------------
+
+    async def _own(self, pooled: PooledClient, ready: asyncio.Future, resume: str | None):
+        """Owner task: build and connect the client, then disconnect it once retired."""
+        try:
+            pooled.client, pooled.slot = self._factory(pooled.key, resume)
+            await pooled.client.connect()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e)
+            return
+        ready.set_result(pooled)
+        try:
+            await pooled._retire.wait()
+        finally:
+            try:
+                await pooled.client.disconnect()
+            except Exception as e:
+                print(f"[Pool] Error disconnecting client: {e}")
+
+    async def _spawn(self, key: Hashable, resume: str | None = None) -> PooledClient:
+        """Start an owner task for a new client and wait until it is connected."""
+        pooled = PooledClient(key, None, None)
+        ready = asyncio.get_running_loop().create_future()
+        pooled._owner = asyncio.create_task(self._own(pooled, ready, resume))
+        return await ready
+
+    def _retire(self, pooled: PooledClient, reason: str):
+        pooled.retire()
+        self._stats["retired"] += 1
+        print(f"[Pool] Retired client ({reason}, {pooled.uses} uses)")
+
+    async def _add_spare(self, key: Hashable):
+        try:
+            pooled = await self._spawn(key)
+        except Exception as e:
+            print(f"[Pool] Failed to start warm client: {e}")
+            return
+        finally:
+            self._spawning[key] -= 1
+        if key not in self._spare_keys:
+            # Pool was closed while this spare was connecting
+            pooled.retire()
+            return
+        self._idle.append(pooled)
+        self._trim()
+
+    def _replenish(self, key: Hashable):
+        """Top the spares for a warm key back up in the background."""
+        if key not in self._spare_keys:
+            return
+        spares = sum(1 for p in self._idle if p.key == key and p.conversation_id is None)
+        for _ in range(self._spare_keys[key] - spares - self._spawning.get(key, 0)):
+            self._spawning[key] = self._spawning.get(key, 0) + 1
+            asyncio.create_task(self._add_spare(key))
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+
+    def _forget(self, key: Hashable):
+        """Stop keeping spares for an expiring key and retire the idle ones."""
+        self._spare_keys.pop(key, None)
+        self._expiring.pop(key, None)
+        for pooled in list(self._idle):
+            if pooled.key == key and pooled.conversation_id is None:
+                self._idle.remove(pooled)
+                self._retire(pooled, "warm key expired")
+
+    def _trim(self):
+        """Retire the least recently used idle clients beyond max_idle."""
+        while len(self._idle) > self.max_idle:
+            oldest = min(self._idle, key=lambda p: p.last_used)
+            self._idle.remove(oldest)
+            self._retire(oldest, "pool full")
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def warm(self, key: Hashable, expires: bool = False):
+        """
+        Keep spares connected for key and start the idle reaper.
+
+        The default configuration gets `size` spares for as long as the pool
+        runs. With expires=True (a user's own credentials) the key gets
+        `key_spares` spares and is dropped once unused for idle_timeout, or
+        when more than max_warm_keys such keys are warm.
+        """
+        if not expires:
+            if self.size <= 0:
+                return
+            self._spare_keys[key] = self.size
+            self._expiring.pop(key, None)
+        elif key not in self._spare_keys or key in self._expiring:
+            if self.key_spares <= 0 or self.max_warm_keys <= 0:
+                return
+            self._spare_keys[key] = self.key_spares
+            self._touch(key)
+            while len(self._expiring) > self.max_warm_keys:
+                self._forget(next(iter(self._expiring)))
+        self._replenish(key)
+        self._ensure_reaper()
+
+    def _touch(self, key: Hashable):
+        """Mark an expiring warm key as just used."""
+        self._expiring[key] = time.monotonic()
+        self._expiring.move_to_end(key)
+
+    def _take(self, key: Hashable, conversation_id: str | None) -> PooledClient | None:
+        """Pop a healthy idle client for key holding conversation_id (None = a spare)."""
+        for pooled in list(self._idle):
+            if pooled.key != key or pooled.conversation_id != conversation_id:
+                continue
+            self._idle.remove(pooled)
+            if pooled.healthy():
+                return pooled
+            self._retire(pooled, "unhealthy")
+        return None
+
+    @asynccontextmanager
+    async def lease(self, key: Hashable, conversation_id: str | None = None):
+        """
+        Lease a connected client for one agent run.
+
+        Args:
+            key: Connection configuration the client must have been built with
+            conversation_id: session_id of the conversation to continue, if any.
+                Served by the client that already holds it, else by a new
+                client resuming it; fresh runs get a warm spare when available.
+
+        The client goes back to the pool (tagged with pooled.conversation_id,
+        which the caller sets from the run's result) only if the block exits
+        normally; errors and cancellation retire it.
+        """
+        start = time.perf_counter()
+        if key in self._expiring:
+            self._touch(key)
+        pooled = self._take(key, conversation_id)
+        if pooled is not None:
+            self._stats["reused_leases" if conversation_id else "warm_leases"] += 1
+            source = "reused" if conversation_id else "warm"
+        else:
+            pooled = await self._spawn(key, resume=conversation_id)
+            self._stats["cold_leases"] += 1
+            source = "cold"
+        if not conversation_id:
+            self._replenish(key)
+        print(f"[Pool] Leased {source} client in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+        completed = False
+        try:
+            yield pooled
+            completed = True
+        finally:
+            pooled.uses += 1
+            pooled.last_used = time.monotonic()
+            pooled.slot.session = None
+            if not completed:
+                self._retire(pooled, "run did not complete")
+            elif not pooled.healthy():
+                self._retire(pooled, "unhealthy")
+            elif not pooled.conversation_id:
+                self._retire(pooled, "no conversation to continue")
+            elif pooled.uses >= self.max_uses:
+                self._retire(pooled, "max uses")
+            else:
+                self._idle.append(pooled)
+                self._trim()
+                self._ensure_reaper()
+
+    async def _reap(self):
+        """Retire used clients whose conversation has gone quiet, dead spares and expired warm keys."""
+        while True:
+            await asyncio.sleep(min(30.0, max(self.idle_timeout / 2, 1.0)))
+            now = time.monotonic()
+            for pooled in list(self._idle):
+                expired = pooled.conversation_id and now - pooled.last_used > self.idle_timeout
+                if expired or not pooled.healthy():
+                    self._idle.remove(pooled)
+                    self._retire(pooled, "idle timeout" if expired else "unhealthy")
+            for key, last_used in list(self._expiring.items()):
+                if now - last_used > self.idle_timeout:
+                    self._forget(key)
+            for key in list(self._spare_keys):
+                self._replenish(key)
+
+    async def close(self):
+        """Retire every idle client and wait for their owners to disconnect."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+        self._spare_keys.clear()
+        self._expiring.clear()
+        owners = [p._owner for p in self._idle if p._owner is not None]
+        for pooled in self._idle:
+            pooled.retire()
+        self._idle.clear()
+        if owners:
+            await asyncio.gather(*owners, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """Lease counters plus the current number of idle clients."""
+        return {
+            **self._stats,
+            "idle": len(self._idle),
+            "spares": sum(1 for p in self._idle if p.conversation_id is None),
+            "warm_keys": len(self._spare_keys),
+        }
@@ -0,0 +1,150 @@
+"""
+Ranked search over detected form fields.
+
+Builds an inverted index over each field's friendly label, native PDF
+field name and nearby label text, and ranks matches with BM25 (fields
+weighted by how reliable a label source is). Query words that do not
+appear in the form are matched fuzzily via character trigrams, so typos
+and partial words ("phon", "adress") still find the right field.
+"""
+
+import math
+import re
+from collections import defaultdict
+
+from pdf_processor import DetectedField
+
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Per-source weights: LLM labels are the cleanest, nearby text the noisiest
+SOURCE_WEIGHTS = {
+    "friendly_label": 3.0,
+    "native_field_name": 2.0,
+    "label_context": 1.0,
+}
+
+# Fuzzy matching for query terms missing from the index
+FUZZY_MIN_SIMILARITY = 0.4
+FUZZY_MAX_EXPANSIONS = 3
+FUZZY_WEIGHT = 0.8
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+# Splits identifiers like "FirstName", "DOB_Month", "f1_01[0]"
+_IDENTIFIER_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Lowercase word tokens."""
+    if not text:
+        return []
+    return _WORD_RE.findall(text.lower())
+
+
+def tokenize_identifier(name: str | None) -> list[str]:
+    """Split a PDF field name on case changes, digits and punctuation."""
+    if not name:
+        return []
+    return [t.lower() for t in _IDENTIFIER_RE.findall(name)]
+
+
+def _trigrams(term: str) -> set[str]:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FieldSearchIndex:
+    """
+    BM25 inverted index over a form's fields.
+
+    Build once per field list (the session rebuilds it when fields are
+    replaced); each search only touches the postings of the query terms.
+
+    Widgets sharing a field_id (radio groups) are indexed as one document,
+    so a group is ranked once and returned as its first widget.
+    """
+    def __init__(self, fields: list[DetectedField]):
+        # One representative per field_id, in form order
+        groups: dict[str, list[DetectedField]] = {}
+        for field in fields:
+            groups.setdefault(field.field_id, []).append(field)
+        self.fields = [widgets[0] for widgets in groups.values()]
+        # term -> {field position: weighted term frequency}
+        self._postings: dict[str, dict[int, float]] = defaultdict(dict)
+        self._doc_lengths: list[float] = []
+        # trigram -> terms, for fuzzy expansion
+        self._trigram_index: dict[str, set[str]] = defaultdict(set)
+
+        for pos, widgets in enumerate(groups.values()):
+            # Each distinct text once: widgets of a group repeat the label and
+            # name, but their nearby text (the option captions) differs
+            sources = {
+                "friendly_label": [tokenize(t) for t in dict.fromkeys(w.friendly_label for w in widgets)],
+                "native_field_name": [tokenize_identifier(t) for t in dict.fromkeys(w.native_field_name for w in widgets)],
+                "label_context": [tokenize(t) for t in dict.fromkeys(w.label_context for w in widgets)],
+            }
+            length = 0.0
+            for source, token_lists in sources.items():
+                weight = SOURCE_WEIGHTS[source]
+                for tokens in token_lists:
+                    length += weight * len(tokens)
+                    for token in tokens:
+                        postings = self._postings[token]
+                        postings[pos] = postings.get(pos, 0.0) + weight
+            self._doc_lengths.append(length)
+
+        for term in self._postings:
+            for gram in _trigrams(term):
+                self._trigram_index[gram].add(term)
+
+        self._avg_length = (sum(self._doc_lengths) / len(self._doc_lengths)) if self._doc_lengths else 0.0
+
+    def _idf(self, term: str) -> float:
+        df = len(self._postings[term])
+        n = len(self.fields)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def _expand(self, term: str) -> list[tuple[str, float]]:
+        """Index terms to score for a query term, with a weight per term."""
+        if term in self._postings:
+            return [(term, 1.0)]
+
+        grams = _trigrams(term)
+        overlap: dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for candidate in self._trigram_index.get(gram, ()):
+                overlap[candidate] += 1
+
+        scored = []
+        for candidate, shared in overlap.items():
+            similarity = shared / len(grams | _trigrams(candidate))
+            if candidate.startswith(term) and len(term) >= 3:
+                similarity = max(similarity, len(term) / len(candidate))
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scored.append((candidate, similarity * FUZZY_WEIGHT))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:FUZZY_MAX_EXPANSIONS]
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[DetectedField, float]]:
+        """
+        Rank fields for a free-text query.
+
+        Returns:
+            Up to `limit` (field, score) pairs, best first
+        """
+        terms = tokenize(query)
+        if not terms or not self.fields:
+            return []
+
+        scores: dict[int, float] = defaultdict(float)
+        for term in dict.fromkeys(terms):
+            for index_term, term_weight in self._expand(term):
+                idf = self._idf(index_term)
+                for pos, tf in self._postings[index_term].items():
+                    norm = 1 - BM25_B + BM25_B * (self._doc_lengths[pos] / self._avg_length)
+                    scores[pos] += term_weight * idf * (tf * (BM25_K1 + 1)) / (tf + BM25_K1 * norm)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(self.fields[pos], score) for pos, score in ranked[:limit]]
@@ -78,6 +78,7 @@ def map_instructions_to_fields(
     instructions: str,
     fields: list[DetectedField],
     model: str = DEFAULT_MODEL,
+    api_key: str | None = None,
 ) -> list[dict]:
     """
     Use LLM to map natural language instructions to specific form field edits.
@@ -89,6 +90,7 @@ def map_instructions_to_fields(
             e.g., "My name is John Doe, I live at 123 Main St, and I agree to the terms"
         fields: List of detected form fields from the PDF
         model: Claude model to use (must support structured outputs)
+        api_key: Anthropic API key for this request (defaults to ANTHROPIC_API_KEY)
         
     Returns:
         List of edits: [{"field_id": str, "value": str|bool}, ...]
@@ -119,7 +121,7 @@ Rules:
 
 Return the edits."""
 
-    client = get_client()
+    client = get_client(api_key)
     
     # Use the structured outputs beta with .parse() for Pydantic support
     response = client.beta.messages.parse(
@@ -6,9 +6,11 @@ This is the main entry point. Run with:
 
 Endpoints:
     POST /analyze            - Upload PDF, get detected form fields
+    POST /analyze-stream     - Upload PDF, stream detected fields page by page (SSE)
     POST /fill-agent         - Fill form fields (agent mode with tools) [RECOMMENDED]
     POST /fill-agent-stream  - Fill form fields with real-time streaming [RECOMMENDED]
     POST /fill               - Fill form fields (single-shot LLM mode) [LEGACY]
+    POST /fill-batch         - Fill one template per CSV/JSONL row, returned as a ZIP
     GET  /                   - Serve the web UI
 
 Note: The agent mode endpoints are recommended for production use. They provide
@@ -16,20 +18,31 @@ better accuracy, error recovery, and support for multi-turn conversations.
 The single-shot /fill endpoint is maintained for backwards compatibility.
 """
 
+import hashlib
 import json
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Literal, Optional
 
-from fastapi import FastAPI, File, Form, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
 from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-from pdf_processor import detect_form_fields, edit_pdf_with_instructions, get_form_summary
+from pdf_processor import (
+    detect_form_fields_async, detect_form_fields_stream,
+    edit_pdf_with_instructions, get_form_summary, shutdown_detection_pool, _field_cache,
+    _template_registry,
+)
 from llm import map_instructions_to_fields
-from agent import run_agent, run_agent_stream, AGENT_SDK_AVAILABLE, AGENT_SDK_ERROR, _session_manager
+from batch_fill import load_rows, stream_batch_zip
+from agent import (
+    run_agent, run_agent_stream, AGENT_SDK_AVAILABLE, AGENT_SDK_ERROR, _session_manager,
+    start_client_pool, stop_client_pool, get_client_pool_stats, warm_client_pool,
+)
+from run_scheduler import _run_scheduler, QueueFullError
 from parser import (
     parse_files_stream, needs_parsing, is_simple_text,
     LLAMAPARSE_AVAILABLE, LLAMAPARSE_ERROR, ParsedFile,
@@ -77,6 +90,14 @@ async def startup_event():
     """Start background tasks on app startup."""
     asyncio.create_task(periodic_session_cleanup())
     print("[App] Started periodic session cleanup task (every 1 hour, cleaning sessions older than 24 hours)")
+    start_client_pool()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the field detection process pool and disconnect pooled agent clients."""
+    shutdown_detection_pool()
+    await stop_client_pool()
 
 # Allow CORS for local development
 app.add_middleware(
@@ -88,6 +109,100 @@ app.add_middleware(
 )
 
 
+# ============================================================================
+# SSE Disconnect Handling
+# ============================================================================
+
+# How often a streaming endpoint checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 1.0
+
+
+async def _wait_for_disconnect(request: Request):
+    """Return once the client has gone away."""
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+async def stream_until_disconnect(request: Request, events, label: str):
+    """
+    Relay an SSE generator, cancelling it as soon as the client disconnects.
+
+    Without this an abandoned stream keeps running (agent turns, LlamaParse
+    jobs) until its next write fails, which may be minutes later. `events`
+    is driven by a single pump task for its whole life, so context variables
+    it sets (the agent's current session) carry over between steps.
+    Cancelling the pump raises CancelledError inside `events`, so its finally
+    blocks (temp file cleanup, releasing the agent client, cancelling parse
+    tasks) run right away.
+    """
+    # One chunk of lookahead: the generator never runs far ahead of the client
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    async def pump():
+        try:
+            async for chunk in events:
+                await queue.put(("chunk", chunk))
+            await queue.put(("end", None))
+        except Exception as e:
+            await queue.put(("error", e))
+        finally:
+            # No-op unless we were cancelled while parked on queue.put
+            await events.aclose()
+
+    pump_task = asyncio.create_task(pump())
+    watcher = asyncio.create_task(_wait_for_disconnect(request))
+    get = None
+    try:
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            await asyncio.wait({get, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                get.cancel()
+                print(f"[{label}] Client disconnected, cancelling stream")
+                return
+            kind, value = get.result()
+            if kind == "end":
+                return
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        watcher.cancel()
+        if get is not None:
+            get.cancel()
+        pump_task.cancel()
+
+
+# ============================================================================
+# Agent Run Admission
+# ============================================================================
+
+def _run_user_key(request: Request, anthropic_api_key: Optional[str] = None) -> str:
+    """
+    Who an agent run counts against for the per-user limit.
+
+    Upstream rate limits are per API key, so runs with a user-supplied key are
+    grouped by a hash of it; everything else is grouped by client address.
+    """
+    if anthropic_api_key:
+        return "key:" + hashlib.sha256(anthropic_api_key.encode()).hexdigest()[:16]
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+@asynccontextmanager
+async def admitted_run(request: Request):
+    """Hold an agent run slot for the block, waiting in the queue if needed."""
+    try:
+        ticket = _run_scheduler.enqueue(_run_user_key(request))
+    except QueueFullError as e:
+        raise HTTPException(503, str(e), headers={"Retry-After": "5"})
+    try:
+        await ticket.wait_until_admitted()
+        yield ticket
+    finally:
+        ticket.release()
+
+
 # ============================================================================
 # API Models
 # ============================================================================
@@ -109,6 +224,10 @@ class AnalyzeResponse(BaseModel):
     field_count: int
 
 
+# Keys of DetectedField.to_dict() exposed by /analyze
+FIELD_INFO_KEYS = tuple(FieldInfo.model_fields)
+
+
 class FillRequest(BaseModel):
     instructions: str
     use_llm: bool = True  # Set to False to use simple keyword mapping
@@ -136,7 +255,7 @@ async def analyze_pdf(file: UploadFile = File(...)):
     pdf_bytes = await file.read()
     
     try:
-        fields = detect_form_fields(pdf_bytes)
+        fields = await detect_form_fields_async(pdf_bytes)
     except Exception as e:
         raise HTTPException(500, f"Failed to analyze PDF: {str(e)}")
     
@@ -148,24 +267,54 @@ async def analyze_pdf(file: UploadFile = File(...)):
             field_count=0
         )
     
-    field_infos = [
-        FieldInfo(
-            field_id=f.field_id,
-            field_type=f.field_type.value,
-            page=f.page,
-            label_context=f.label_context,
-            friendly_label=f.friendly_label,
-            current_value=f.current_value,
-            options=f.options
-        )
-        for f in fields
-    ]
-    
-    return AnalyzeResponse(
-        success=True,
-        message=f"Found {len(fields)} fillable form fields",
-        fields=field_infos,
-        field_count=len(fields)
+    # Serialize directly instead of validating a FieldInfo model per field;
+    # the payload still matches AnalyzeResponse
+    return Response(
+        content=json.dumps({
+            "success": True,
+            "message": f"Found {len(fields)} fillable form fields",
+            "fields": [f.to_dict(FIELD_INFO_KEYS) for f in fields],
+            "field_count": len(fields),
+        }),
+        media_type="application/json",
+    )
+
+
+@app.post("/analyze-stream")
+async def analyze_pdf_stream(file: UploadFile = File(...)):
+    """
+    Analyze a PDF and stream detected form fields as Server-Sent Events.
+
+    Fields are sent page by page as soon as each page is scanned, so large
+    forms render before the whole document (and the friendly-label LLM
+    call) is done. Friendly labels follow as separate patch events.
+
+    Event types:
+    - start: Scan started (page_count, cached)
+    - page: Fields found on one page (page, fields)
+    - labels: Friendly label patch ({field_id: label}) for a batch of fields
+    - complete: Detection finished (field_count)
+    - error: Error occurred
+    """
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(400, "File must be a PDF")
+
+    pdf_bytes = await file.read()
+
+    async def event_stream():
+        try:
+            async for event in detect_form_fields_stream(pdf_bytes):
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'type': 'error', 'error': f'Failed to analyze PDF: {str(e)}'})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
     )
 
 
@@ -173,6 +322,7 @@ async def analyze_pdf(file: UploadFile = File(...)):
 async def fill_pdf(
     file: UploadFile = File(...),
     instructions: str = Form(...),
+    anthropic_api_key: Optional[str] = Form(None),  # User's Anthropic API key
 ):
     """
     [LEGACY] Fill a PDF form using single-shot LLM mode.
@@ -187,6 +337,7 @@ async def fill_pdf(
         instructions: Natural language description of what to fill
             e.g., "My name is John Doe, I live at 123 Main St,
                    my phone is 555-1234, and I agree to the terms"
+        anthropic_api_key: User's Anthropic API key for the labeling and mapping calls
 
     Returns:
         The filled PDF file as a download
@@ -198,7 +349,7 @@ async def fill_pdf(
     
     # Step 1: Detect form fields
     try:
-        fields = detect_form_fields(pdf_bytes)
+        fields = await detect_form_fields_async(pdf_bytes, api_key=anthropic_api_key)
     except Exception as e:
         raise HTTPException(500, f"Failed to analyze PDF: {str(e)}")
     
@@ -213,7 +364,7 @@ async def fill_pdf(
     # Note: The simple keyword mapping (use_llm=False) is no longer supported.
     # Use the agent endpoints for better accuracy.
     try:
-        edits = map_instructions_to_fields(instructions, fields)
+        edits = map_instructions_to_fields(instructions, fields, api_key=anthropic_api_key)
     except ValueError as e:
         raise HTTPException(
             500,
@@ -231,7 +382,7 @@ async def fill_pdf(
     
     # Step 3: Apply edits
     try:
-        filled_pdf = edit_pdf_with_instructions(pdf_bytes, edits)
+        filled_pdf = edit_pdf_with_instructions(pdf_bytes, edits, fields)
     except Exception as e:
         raise HTTPException(500, f"Failed to fill PDF: {str(e)}")
     
@@ -252,6 +403,7 @@ async def fill_pdf(
 async def fill_pdf_preview(
     file: UploadFile = File(...),
     instructions: str = Form(...),
+    anthropic_api_key: Optional[str] = Form(None),  # User's Anthropic API key
 ):
     """
     [LEGACY] Preview what fields would be filled without actually filling them.
@@ -267,7 +419,7 @@ async def fill_pdf_preview(
 
     # Detect fields
     try:
-        fields = detect_form_fields(pdf_bytes)
+        fields = await detect_form_fields_async(pdf_bytes, api_key=anthropic_api_key)
     except Exception as e:
         raise HTTPException(500, f"Failed to analyze PDF: {str(e)}")
 
@@ -281,7 +433,7 @@ async def fill_pdf_preview(
 
     # Map instructions using LLM
     try:
-        edits = map_instructions_to_fields(instructions, fields)
+        edits = map_instructions_to_fields(instructions, fields, api_key=anthropic_api_key)
     except ValueError as e:
         raise HTTPException(500, f"LLM error: {str(e)}")
     
@@ -293,12 +445,70 @@ async def fill_pdf_preview(
     }
 
 
+@app.post("/fill-batch")
+async def fill_pdf_batch(
+    file: UploadFile = File(...),
+    rows_file: UploadFile = File(...),
+):
+    """
+    Fill one template PDF for every record in a CSV or JSONL file (mail merge).
+
+    Fields are detected once for the template; rows are filled in parallel
+    across a process pool and streamed back as a ZIP as they complete.
+
+    Args:
+        file: The template PDF
+        rows_file: CSV (header row of field names) or JSONL (one object per line).
+            Keys are field_ids or native field names; an optional "_filename"
+            column names each output PDF.
+
+    Returns:
+        A ZIP of filled PDFs (plus errors.json if any row failed)
+    """
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(400, "File must be a PDF")
+
+    pdf_bytes = await file.read()
+
+    try:
+        rows = load_rows(await rows_file.read(), rows_file.filename or "")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(400, f"Failed to read rows: {str(e)}")
+
+    if not rows:
+        raise HTTPException(400, "The rows file contains no records")
+
+    try:
+        fields = await detect_form_fields_async(pdf_bytes, generate_friendly_labels=False)
+    except Exception as e:
+        raise HTTPException(500, f"Failed to analyze PDF: {str(e)}")
+
+    if not fields:
+        raise HTTPException(
+            400,
+            "No fillable form fields found in this PDF. "
+            "Batch fill only works with PDFs that have native AcroForm fields."
+        )
+
+    filename = file.filename.replace('.pdf', '_filled.zip')
+
+    return StreamingResponse(
+        stream_batch_zip(pdf_bytes, rows, file.filename, fields),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Rows": str(len(rows)),
+        }
+    )
+
+
 # ============================================================================
 # Agent Mode Endpoint
 # ============================================================================
 
 @app.post("/fill-agent")
 async def fill_pdf_agent(
+    request: Request,
     file: UploadFile = File(...),
     instructions: str = Form(...),
     max_iterations: int = Form(20),
@@ -329,7 +539,7 @@ async def fill_pdf_agent(
     
     # Check for form fields first
     try:
-        fields = detect_form_fields(pdf_bytes)
+        fields = await detect_form_fields_async(pdf_bytes)
     except Exception as e:
         raise HTTPException(500, f"Failed to analyze PDF: {str(e)}")
     
@@ -352,19 +562,19 @@ async def fill_pdf_agent(
         output_path = tmp_path.replace('.pdf', '_filled.pdf')
         
         try:
-            # Use await since we're in an async context
-            summary = await run_agent(tmp_path, instructions, output_path)
+            # Use await since we're in an async context.
+            # The filled PDF stays in memory on the session; nothing is written to output_path.
+            async with admitted_run(request):
+                summary = await run_agent(
+                    tmp_path, instructions, output_path, persist_output=False, max_iterations=max_iterations
+                )
             
-            if os_module.path.exists(output_path):
-                with open(output_path, 'rb') as f:
-                    filled_pdf = f.read()
-            else:
+            filled_pdf = _session_manager.get_session_pdf_bytes(summary["user_session_id"])
+            if filled_pdf is None:
                 raise HTTPException(500, "Agent did not produce output PDF")
         finally:
             if os_module.path.exists(tmp_path):
                 os_module.unlink(tmp_path)
-            if os_module.path.exists(output_path):
-                os_module.unlink(output_path)
     except HTTPException:
         raise
     except ValueError as e:
@@ -385,19 +595,24 @@ async def fill_pdf_agent(
     # Return the filled PDF
     filename = file.filename.replace('.pdf', '_agent_filled.pdf')
     
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Fields-Filled": str(applied_count),
+        "X-Agent-Iterations": str(iterations),
+    }
+    if summary.get("budget_exceeded"):
+        headers["X-Budget-Exceeded"] = summary["budget_exceeded"]
+
     return Response(
         content=filled_pdf,
         media_type="application/pdf",
-        headers={
-            "Content-Disposition": f'attachment; filename="{filename}"',
-            "X-Fields-Filled": str(applied_count),
-            "X-Agent-Iterations": str(iterations),
-        }
+        headers=headers,
     )
 
 
 @app.post("/fill-agent-preview")
 async def fill_pdf_agent_preview(
+    request: Request,
     file: UploadFile = File(...),
     instructions: str = Form(...),
     max_iterations: int = Form(20),
@@ -424,13 +639,16 @@ async def fill_pdf_agent_preview(
         
         try:
             # Use await since we're in an async context
-            summary = await run_agent(tmp_path, instructions, output_path)
+            async with admitted_run(request):
+                summary = await run_agent(
+                    tmp_path, instructions, output_path, persist_output=False, max_iterations=max_iterations
+                )
         finally:
             if os_module.path.exists(tmp_path):
                 os_module.unlink(tmp_path)
-            if os_module.path.exists(output_path):
-                os_module.unlink(output_path)
                 
+    except HTTPException:
+        raise
     except ValueError as e:
         return {
             "success": False,
@@ -446,6 +664,8 @@ async def fill_pdf_agent_preview(
         "success": True,
         "message": f"Agent completed with {summary.get('message_count', 0)} messages",
         "result": summary.get("result", ""),
+        "iterations": summary.get("iterations"),
+        "budget_exceeded": summary.get("budget_exceeded"),
     }
 
 
@@ -459,6 +679,7 @@ import asyncio
 
 @app.post("/fill-agent-stream")
 async def fill_pdf_agent_stream(
+    request: Request,
     file: UploadFile = File(...),
     instructions: str = Form(...),
     max_iterations: int = Form(20),
@@ -487,7 +708,9 @@ async def fill_pdf_agent_stream(
     - iteration: New iteration started
     - text: Agent thinking/response text
     - tool_start: Tool call started
+    - queued: Waiting for a free agent slot (includes position, updated as it changes)
     - tool_end: Tool call completed with result
+    - budget_exceeded: max_iterations or AGENT_RUN_TIMEOUT reached; staged edits were committed
     - complete: Agent finished (includes applied_edits, session_id, and user_session_id for tracking)
     - pdf_ready: Final summary with filled PDF (hex-encoded)
     - error: Error occurred
@@ -525,12 +748,25 @@ async def fill_pdf_agent_stream(
 
         tmp_path = None
         output_path = None
+        final_session_id = None
 
         # Send immediate acknowledgment
         cont_msg = " (continuation)" if is_continuation else ""
         yield f"data: {json.dumps({'type': 'init', 'message': f'Stream connected, initializing agent{cont_msg}...'})}\n\n"
 
+        # Continuation turns are short and interactive, so they wait less than fresh fills
+        try:
+            ticket = _run_scheduler.enqueue(
+                _run_user_key(request, anthropic_api_key), continuation=is_continuation
+            )
+        except QueueFullError as e:
+            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+            return
+
         try:
+            async for position in ticket.wait():
+                yield f"data: {json.dumps({'type': 'queued', 'position': position, 'message': f'Waiting for a free agent slot (position {position} in queue)...'})}\n\n"
+
             with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
                 tmp.write(pdf_bytes)
                 tmp_path = tmp.name
@@ -552,20 +788,22 @@ async def fill_pdf_agent_stream(
                 user_session_id=user_session_id,
                 original_pdf_bytes=pdf_bytes if not is_continuation else None,
                 anthropic_api_key=anthropic_api_key,
+                persist_output=False,
+                max_iterations=max_iterations,
             ):
                 message_count += 1
+                if message.get("type") == "complete":
+                    final_session_id = message.get("user_session_id")
                 # Convert message to JSON and send as SSE
                 yield f"data: {json.dumps(message, default=str)}\n\n"
             
             if message_count == 0:
                 yield f"data: {json.dumps({'type': 'error', 'error': 'Agent produced no messages - SDK may not be working'})}\n\n"
             
-            # After streaming completes, check for output PDF
-            if output_path and os_module.path.exists(output_path):
-                # Read the filled PDF and include in final message
-                with open(output_path, 'rb') as f:
-                    pdf_hex = f.read().hex()
-                yield f"data: {json.dumps({'type': 'pdf_ready', 'pdf_bytes': pdf_hex})}\n\n"
+            # After streaming completes, send the committed PDF straight from the session
+            filled_pdf = _session_manager.get_session_pdf_bytes(final_session_id) if final_session_id else None
+            if filled_pdf:
+                yield f"data: {json.dumps({'type': 'pdf_ready', 'pdf_bytes': filled_pdf.hex()})}\n\n"
             else:
                 yield f"data: {json.dumps({'type': 'error', 'error': 'No output PDF generated'})}\n\n"
                 
@@ -574,14 +812,14 @@ async def fill_pdf_agent_stream(
         except Exception as e:
             yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
         finally:
+            # Free the run slot (or leave the queue) so the next run can start
+            ticket.release()
             # Clean up temp files
             if tmp_path and os_module.path.exists(tmp_path):
                 os_module.unlink(tmp_path)
-            if output_path and os_module.path.exists(output_path):
-                os_module.unlink(output_path)
     
     return StreamingResponse(
-        event_stream(),
+        stream_until_disconnect(request, event_stream(), "Agent Stream"),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -621,12 +859,24 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/cache-stats")
+async def get_cache_stats():
+    """Hit/miss counters for the field detection cache, template registry, agent client pool and run queue."""
+    return {
+        "field_detection": _field_cache.stats(),
+        "templates": _template_registry.stats(),
+        "agent_clients": get_client_pool_stats(),
+        "agent_runs": _run_scheduler.stats(),
+    }
+
+
 # ============================================================================
 # Context File Parsing
 # ============================================================================
 
 @app.post("/parse-files")
 async def parse_context_files(
+    request: Request,
     files: list[UploadFile] = File(...),
     parse_mode: str = Form("cost_effective"),
     user_session_id: Optional[str] = Form(None),
@@ -756,7 +1006,7 @@ async def parse_context_files(
             yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
 
     return StreamingResponse(
-        event_stream(),
+        stream_until_disconnect(request, event_stream(), "Parse"),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -887,6 +1137,8 @@ async def validate_anthropic_key(api_key: str = Form(...)):
                     detail=f"Failed to validate API key: {response.text}"
                 )
 
+            # The app will use this key for its agent runs: start a client for it now
+            warm_client_pool(api_key)
             return {"valid": True, "message": "API key is valid"}
 
     except httpx.TimeoutException:
@@ -1015,8 +1267,10 @@ if __name__ == "__main__":
     print("="*60)
     print("\nRecommended Endpoints:")
     print("  POST /analyze            - Detect form fields in a PDF")
+    print("  POST /analyze-stream     - Detect form fields, streamed page by page (SSE)")
     print("  POST /fill-agent-stream  - Fill form (agent mode, SSE streaming)")
     print("  POST /fill-agent         - Fill form (agent mode)")
+    print("  POST /fill-batch         - Fill a template for every CSV/JSONL row (ZIP)")
     print("\nLegacy Endpoints (deprecated):")
     print("  POST /fill               - Fill (single-shot LLM mode)")
     print("  POST /fill-preview       - Preview single-shot mode")
@@ -379,21 +379,31 @@ async def parse_files_stream(
         await asyncio.gather(*tasks)
         await event_queue.put({"type": "_done"})
 
-    asyncio.create_task(wait_for_tasks())
+    waiter = asyncio.create_task(wait_for_tasks())
 
     # Yield events as they arrive
     completed_count = 0
-    while True:
-        event = await event_queue.get()
+    try:
+        while True:
+            event = await event_queue.get()
 
-        if event["type"] == "_done":
-            break
+            if event["type"] == "_done":
+                break
 
-        # Track completions for final summary
-        if event["type"] == "progress" and event.get("status") in ("complete", "error"):
-            completed_count += 1
+            # Track completions for final summary
+            if event["type"] == "progress" and event.get("status") in ("complete", "error"):
+                completed_count += 1
 
-        yield event
+            yield event
+    finally:
+        # If the consumer stopped early (e.g. the client disconnected), stop the
+        # parses still running; parse_file removes its temp file on cancellation
+        unfinished = [task for task in tasks if not task.done()]
+        for task in unfinished:
+            task.cancel()
+        waiter.cancel()
+        if unfinished:
+            print(f"[Parse] Cancelled {len(unfinished)} unfinished parse task(s)")
 
     # Build final results in original order
     ordered_results = [results[i] for i in range(total)]
@@ -3,17 +3,31 @@ Core PDF form processing logic.
 
 This module handles:
 1. Detecting fillable AcroForm fields in PDFs
-2. Applying edits to form fields
+2. Applying edits to form fields (saved as incremental updates when possible)
+3. Caching detection results by PDF content hash
+4. Recognizing known form templates by structural fingerprint
 
 Edit this file to customize PDF processing behavior.
 """
 
-from dataclasses import dataclass, asdict
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from enum import Enum
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import AsyncGenerator
+import asyncio
 import fitz  # PyMuPDF
+import hashlib
 import json
+import numpy as np
 import os
-from anthropic import Anthropic
+import sqlite3
+import sys
+import threading
+import time
+from anthropic import AsyncAnthropic
 
 
 class FieldType(Enum):
@@ -23,9 +37,14 @@ class FieldType(Enum):
     RADIO = "radio"
 
 
-@dataclass
+@dataclass(slots=True)
 class DetectedField:
-    """Represents a detected form field in the PDF."""
+    """
+    Represents a detected form field in the PDF.
+
+    Slotted to keep per-field memory small: sessions and the detection
+    cache hold these lists for hours, often for thousands of fields.
+    """
     field_id: str
     field_type: FieldType
     bbox: tuple[float, float, float, float]  # (x0, y0, x1, y1)
@@ -35,13 +54,52 @@ class DetectedField:
     options: list[str] | None = None  # for dropdowns/radios
     native_field_name: str | None = None  # the AcroForm field name
     friendly_label: str | None = None  # LLM-generated clean label for display
-
-    def to_dict(self) -> dict:
-        """Convert to dictionary for JSON serialization."""
-        d = asdict(self)
-        d['field_type'] = self.field_type.value
+    widget_xref: int | None = None  # PDF object number of the widget annotation
+
+    def to_dict(self, keys: tuple[str, ...] | None = None) -> dict:
+        """
+        Convert to dictionary for JSON serialization.
+
+        Built directly rather than via dataclasses.asdict, which deep-copies
+        every value. Pass keys to emit only a subset of fields.
+        """
+        d = {
+            "field_id": self.field_id,
+            "field_type": self.field_type.value,
+            "bbox": self.bbox,
+            "page": self.page,
+            "label_context": self.label_context,
+            "current_value": self.current_value,
+            "options": list(self.options) if self.options is not None else None,
+            "native_field_name": self.native_field_name,
+            "friendly_label": self.friendly_label,
+            "widget_xref": self.widget_xref,
+        }
+        if keys is not None:
+            return {k: d[k] for k in keys}
         return d
 
+    @classmethod
+    def from_dict(cls, data: dict) -> "DetectedField":
+        """Rebuild a field from the output of to_dict()."""
+        return cls(
+            field_id=_intern(data["field_id"]),
+            field_type=FieldType(data["field_type"]),
+            bbox=tuple(data["bbox"]),
+            page=data["page"],
+            label_context=data["label_context"],
+            current_value=data.get("current_value"),
+            options=list(data["options"]) if data.get("options") is not None else None,
+            native_field_name=_intern(data.get("native_field_name")),
+            friendly_label=_intern(data.get("friendly_label")),
+            widget_xref=data.get("widget_xref"),
+        )
+
+
+def _intern(value: str | None) -> str | None:
+    """Intern short identifier strings so repeated templates share one copy."""
+    return sys.intern(value) if value is not None else None
+
 
 @dataclass 
 class FieldEdit:
@@ -50,105 +108,497 @@ class FieldEdit:
     value: str | bool
 
 
-def detect_form_fields(pdf_bytes: bytes, generate_friendly_labels: bool = True) -> list[DetectedField]:
+class AppearanceMode(Enum):
+    """How widget appearance streams are produced when field values change."""
+    IMMEDIATE = "immediate"                # widget.update() after every value
+    DEFERRED = "deferred"                  # set all values, then regenerate once per page
+    NEED_APPEARANCES = "need_appearances"  # set values only; the viewer draws the fields
+
+
+# Default appearance mode for apply_edits and the agent's commit_edits
+APPEARANCE_MODE = AppearanceMode(os.environ.get("APPEARANCE_MODE", "deferred"))
+
+
+def detect_form_fields(
+    pdf_bytes: bytes,
+    generate_friendly_labels: bool = True,
+    use_cache: bool = True,
+    parallel: bool | None = None,
+    use_templates: bool = True,
+    api_key: str | None = None,
+) -> list[DetectedField]:
     """
     Detect all fillable AcroForm fields in the PDF.
 
     This ONLY detects native PDF form widgets (AcroForm fields).
     Non-form PDFs will return an empty list.
 
+    Results are cached by a SHA-256 of the PDF bytes, so re-analyzing the
+    same upload (e.g. /analyze followed by the agent's load_pdf) skips both
+    the PyMuPDF scan and the friendly-label LLM call.
+
+    On a cache miss the widgets are matched against the template registry
+    by structural fingerprint; known forms reuse the registered labels and
+    context, with only this upload's current values overlaid.
+
     Args:
         pdf_bytes: The PDF file as bytes
         generate_friendly_labels: If True, use LLM to generate clean labels
+        use_cache: If True, consult and populate the field detection cache
+        parallel: Shard pages across the detection process pool. None picks
+            automatically based on page count (PARALLEL_DETECTION_MIN_PAGES)
+        use_templates: If True, consult the template registry
+        api_key: Anthropic API key for the labeling calls (defaults to ANTHROPIC_API_KEY)
 
     Returns:
         List of detected form fields with their metadata
     """
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    fields = []
-
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        widgets = list(page.widgets())
-
-        for widget in widgets:
-            # Skip null/invalid widgets
-            if not widget.field_name:
-                continue
-
-            field_type = _widget_type_to_field_type(widget.field_type)
-
-            # Get dropdown/radio options if applicable
-            options = None
-            if widget.field_type in (fitz.PDF_WIDGET_TYPE_COMBOBOX, fitz.PDF_WIDGET_TYPE_LISTBOX):
-                options = widget.choice_values or []
-
-            # Get current value
-            current_value = widget.field_value
-            if isinstance(current_value, bool):
-                current_value = str(current_value).lower()
-
-            fields.append(DetectedField(
-                field_id=f"page{page_num}_{widget.field_name}",
-                field_type=field_type,
-                bbox=tuple(widget.rect),
-                page=page_num,
-                label_context=_extract_nearby_text(page, widget.rect),
-                current_value=current_value,
-                options=options,
-                native_field_name=widget.field_name
-            ))
+    cache_key = None
+    if use_cache:
+        cache_key = FieldDetectionCache.make_key(pdf_bytes, generate_friendly_labels)
+        cached = _field_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-    doc.close()
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    page_count = len(doc)
+
+    # Widgets only (no text extraction) - enough to fingerprint the form
+    scanned = None
+    if use_templates and _template_registry:
+        scanned = _scan_widgets(doc)
+        fields = _template_registry.match(scanned)
+        if fields is not None:
+            doc.close()
+            if cache_key:
+                _field_cache.put(cache_key, fields)
+            return fields
+
+    if parallel is None:
+        parallel = DETECTION_WORKERS > 1 and page_count >= PARALLEL_DETECTION_MIN_PAGES
+
+    if parallel and page_count > 1:
+        doc.close()
+        fields = _detect_fields_parallel(pdf_bytes, page_count)
+    elif scanned is not None:
+        # Reuse the widget scan and only add the nearby-text context
+        for page_num in sorted({f.page for f in scanned}):
+            _add_label_context(doc[page_num], [f for f in scanned if f.page == page_num])
+        fields = scanned
+        doc.close()
+    else:
+        fields = []
+        for page_num in range(page_count):
+            fields.extend(_detect_page_fields(doc[page_num], page_num))
+        doc.close()
 
     # Generate friendly labels using LLM
+    labels_complete = True
     if generate_friendly_labels and fields:
-        fields = _generate_friendly_labels(fields)
+        fields, labels_complete = _generate_friendly_labels(fields, api_key=api_key)
 
     # print(f"Detected {len(fields)} fields")
     # print(fields)
     # raise Exception("Stop here")
 
+    if labels_complete:
+        if use_templates and generate_friendly_labels and TEMPLATE_AUTO_REGISTER and fields:
+            _template_registry.register(fields)
+        if cache_key:
+            _field_cache.put(cache_key, fields)
+    elif use_cache:
+        _cache_raw_scan(pdf_bytes, fields)
+
     return fields
 
 
-def apply_edits(pdf_bytes: bytes, edits: list[FieldEdit]) -> bytes:
+def _cache_raw_scan(pdf_bytes: bytes, fields: list[DetectedField]):
+    """
+    Cache only the widget scan of a form whose labeling partly failed.
+
+    Fallback labels (native names) must not land under the labeled key:
+    that entry is shared by every user and persisted to disk, so one bad or
+    missing API key would otherwise pin them for everyone.
+    """
+    print("[Labels] Labeling incomplete, caching the raw scan only")
+    raw_key = FieldDetectionCache.make_key(pdf_bytes, False)
+    _field_cache.put(raw_key, [replace(f, friendly_label=None) for f in fields])
+
+
+async def detect_form_fields_async(
+    pdf_bytes: bytes,
+    generate_friendly_labels: bool = True,
+    use_cache: bool = True,
+    parallel: bool | None = None,
+    api_key: str | None = None,
+) -> list[DetectedField]:
+    """
+    Run detect_form_fields on a worker thread so the event loop stays responsive.
+
+    Large documents are additionally sharded across the detection process
+    pool (see detect_form_fields), so the CPU-bound PyMuPDF work does not
+    hold the API process's GIL.
+    """
+    return await asyncio.to_thread(
+        detect_form_fields, pdf_bytes, generate_friendly_labels, use_cache, parallel, api_key=api_key
+    )
+
+
+async def detect_form_fields_stream(
+    pdf_bytes: bytes,
+    generate_friendly_labels: bool = True,
+    use_cache: bool = True,
+    api_key: str | None = None,
+) -> AsyncGenerator[dict, None]:
+    """
+    Detect form fields page by page, yielding results as soon as each page
+    is scanned.
+
+    Friendly labels are generated after the scan and arrive as separate
+    patch events, one per label batch, so clients can render fields before
+    the LLM call finishes. The final field list is stored in the detection
+    cache just like detect_form_fields.
+
+    Args:
+        pdf_bytes: The PDF file as bytes
+        generate_friendly_labels: If True, use LLM to generate clean labels
+        use_cache: If True, consult and populate the field detection cache
+        api_key: Anthropic API key for the labeling calls (defaults to ANTHROPIC_API_KEY)
+
+    Yields:
+        {"type": "start", "page_count": int, "cached": bool}
+        {"type": "page", "page": int, "fields": [field dicts]}
+        {"type": "labels", "labels": {field_id: friendly_label}}
+        {"type": "complete", "field_count": int}
+    """
+    cache_key = None
+    if use_cache:
+        cache_key = FieldDetectionCache.make_key(pdf_bytes, generate_friendly_labels)
+        cached = _field_cache.get(cache_key)
+        if cached is not None:
+            page_count = max((f.page for f in cached), default=-1) + 1
+            yield {"type": "start", "page_count": page_count, "cached": True}
+            for page_num in range(page_count):
+                page_fields = [f.to_dict() for f in cached if f.page == page_num]
+                if page_fields:
+                    yield {"type": "page", "page": page_num, "fields": page_fields}
+            yield {"type": "complete", "field_count": len(cached)}
+            return
+
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    fields: list[DetectedField] = []
+    try:
+        yield {"type": "start", "page_count": len(doc), "cached": False}
+        for page_num in range(len(doc)):
+            # Scan off the event loop; pages are processed one at a time
+            page_fields = await asyncio.to_thread(_detect_page_fields, doc[page_num], page_num)
+            fields.extend(page_fields)
+            if page_fields:
+                yield {"type": "page", "page": page_num, "fields": [f.to_dict() for f in page_fields]}
+    finally:
+        doc.close()
+
+    labels_complete = True
+    if generate_friendly_labels and fields:
+        async for batch_labels, batch_ok in _iter_friendly_label_batches(fields, api_key=api_key):
+            labels_complete = labels_complete and batch_ok
+            for i, label in batch_labels.items():
+                fields[i].friendly_label = label
+            yield {
+                "type": "labels",
+                "labels": {fields[i].field_id: label for i, label in batch_labels.items()},
+            }
+
+    if labels_complete:
+        if cache_key:
+            _field_cache.put(cache_key, fields)
+    elif use_cache:
+        _cache_raw_scan(pdf_bytes, fields)
+
+    yield {"type": "complete", "field_count": len(fields)}
+
+
+# ============================================================================
+# Parallel Detection
+# ============================================================================
+
+# Worker processes used to scan large documents
+DETECTION_WORKERS = int(os.environ.get("DETECTION_WORKERS", str(os.cpu_count() or 1)))
+# Documents with at least this many pages are scanned in parallel by default
+PARALLEL_DETECTION_MIN_PAGES = int(os.environ.get("PARALLEL_DETECTION_MIN_PAGES", "8"))
+
+_detection_pool: ProcessPoolExecutor | None = None
+_detection_pool_lock = threading.Lock()
+
+
+def _get_detection_pool() -> ProcessPoolExecutor:
+    """Get the shared detection process pool, creating it on first use."""
+    global _detection_pool
+    with _detection_pool_lock:
+        if _detection_pool is None:
+            _detection_pool = ProcessPoolExecutor(max_workers=max(1, DETECTION_WORKERS))
+            print(f"[Detection] Started process pool with {DETECTION_WORKERS} workers")
+        return _detection_pool
+
+
+def shutdown_detection_pool():
+    """Stop the detection process pool (called on app shutdown)."""
+    global _detection_pool
+    with _detection_pool_lock:
+        if _detection_pool is not None:
+            _detection_pool.shutdown(cancel_futures=True)
+            _detection_pool = None
+
+
+def _detect_fields_parallel(pdf_bytes: bytes, page_count: int) -> list[DetectedField]:
+    """
+    Scan page ranges across the detection process pool.
+
+    The PDF is copied once into shared memory; each worker opens its own
+    document from it and returns the fields for its page range. Results are
+    merged in page order.
+    """
+    shard_count = min(max(1, DETECTION_WORKERS), page_count)
+    shard_size = -(-page_count // shard_count)  # ceil division
+    ranges = [(start, min(start + shard_size, page_count)) for start in range(0, page_count, shard_size)]
+
+    shm = shared_memory.SharedMemory(create=True, size=len(pdf_bytes))
+    try:
+        shm.buf[:len(pdf_bytes)] = pdf_bytes
+        pool = _get_detection_pool()
+        futures = [
+            pool.submit(_detect_page_range, shm.name, len(pdf_bytes), start, stop)
+            for start, stop in ranges
+        ]
+        fields = []
+        for future in futures:
+            fields.extend(future.result())
+        return fields
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _detect_page_range(shm_name: str, size: int, start: int, stop: int) -> list[DetectedField]:
+    """Worker: detect fields on pages [start, stop) of the PDF in shared memory."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        pdf_bytes = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        fields = []
+        for page_num in range(start, stop):
+            fields.extend(_detect_page_fields(doc[page_num], page_num))
+        return fields
+    finally:
+        doc.close()
+
+
+def _detect_page_fields(page: fitz.Page, page_num: int) -> list[DetectedField]:
+    """Detect the AcroForm fields on a single page (without friendly labels)."""
+    fields = _scan_page_widgets(page, page_num)
+    _add_label_context(page, fields)
+    return fields
+
+
+def _scan_page_widgets(page: fitz.Page, page_num: int) -> list[DetectedField]:
+    """Read a page's AcroForm widgets without any text extraction (label_context left empty)."""
+    fields = []
+    for widget in page.widgets():
+        # Skip null/invalid widgets
+        if not widget.field_name:
+            continue
+
+        field_type = _widget_type_to_field_type(widget.field_type)
+
+        # Get dropdown/radio options if applicable
+        options = None
+        if widget.field_type in (fitz.PDF_WIDGET_TYPE_COMBOBOX, fitz.PDF_WIDGET_TYPE_LISTBOX):
+            options = widget.choice_values or []
+
+        # Get current value
+        current_value = widget.field_value
+        if isinstance(current_value, bool):
+            current_value = str(current_value).lower()
+
+        fields.append(DetectedField(
+            field_id=_intern(f"page{page_num}_{widget.field_name}"),
+            field_type=field_type,
+            bbox=tuple(widget.rect),
+            page=page_num,
+            label_context="",
+            current_value=current_value,
+            options=options,
+            native_field_name=_intern(widget.field_name),
+            widget_xref=widget.xref,
+        ))
+
+    return fields
+
+
+def _scan_widgets(doc: fitz.Document) -> list[DetectedField]:
+    """Scan every page's widgets (see _scan_page_widgets)."""
+    fields = []
+    for page_num in range(len(doc)):
+        fields.extend(_scan_page_widgets(doc[page_num], page_num))
+    return fields
+
+
+def _add_label_context(page: fitz.Page, page_fields: list[DetectedField]):
+    """Fill in label_context for fields on one page from a single word index."""
+    if not page_fields:
+        return
+    # Extract the page's words once; every widget's nearby-text lookup queries this
+    word_index = _PageWordIndex(page)
+    for field in page_fields:
+        field.label_context = _extract_nearby_text(word_index, fitz.Rect(field.bbox))
+
+
+def apply_edits(
+    pdf_bytes: bytes,
+    edits: list[FieldEdit],
+    fields: list[DetectedField] | None = None,
+    incremental: bool = True,
+    appearance_mode: AppearanceMode | None = None,
+) -> bytes:
     """
     Apply a list of edits to form fields in the PDF.
-    
+
+    Only the widgets named in the edit list are loaded and updated, using a
+    field_id -> (page, widget xref) index. The index comes from `fields`
+    when given, otherwise from the field detection cache, and is built with
+    one widget walk (then cached) as a last resort.
+
     Args:
         pdf_bytes: The original PDF as bytes
         edits: List of field edits to apply
-        
+        fields: Optional fields from detect_form_fields for this exact PDF
+        incremental: Append only the changed objects to pdf_bytes instead of
+            rewriting the whole document (see save_pdf_bytes)
+        appearance_mode: How appearance streams are regenerated (see
+            write_field_values); defaults to APPEARANCE_MODE
+
     Returns:
         Modified PDF as bytes
     """
     doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    
-    # Build a lookup of field_id -> edit
-    edit_map = {e.field_id: e for e in edits}
-    
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        
-        for widget in page.widgets():
-            if not widget.field_name:
-                continue
-                
-            field_id = f"page{page_num}_{widget.field_name}"
-            
-            if field_id in edit_map:
-                edit = edit_map[field_id]
-                _apply_widget_edit(widget, edit.value)
-    
-    result = doc.tobytes()
+
+    widget_index = get_widget_index(doc, fields, pdf_bytes)
+
+    # Build a lookup of field_id -> value (last edit for a field wins)
+    values = {e.field_id: e.value for e in edits}
+    write_field_values(doc, values, widget_index, appearance_mode)
+
+    result = save_pdf_bytes(doc, incremental=incremental)
     doc.close()
     return result
 
 
+def write_field_values(
+    doc: fitz.Document,
+    values: dict[str, str | bool],
+    widget_index: dict,
+    appearance_mode: AppearanceMode | None = None,
+    timings: dict | None = None,
+) -> tuple[list[str], dict[str, str]]:
+    """
+    Set field values on an open document.
+
+    Edits are grouped by page and each page is visited once. In IMMEDIATE
+    mode each widget is loaded and updated on its own, which regenerates
+    that widget's appearance stream right away. DEFERRED writes every /V on
+    the page first and then regenerates its dirty widgets in one pass.
+    NEED_APPEARANCES skips appearance generation entirely: stale appearances
+    of changed text/choice widgets are dropped and the AcroForm
+    /NeedAppearances flag tells the viewer to draw them.
+
+    Args:
+        doc: The open PDF
+        values: field_id -> value
+        widget_index: field_id -> [(page, widget xref)], see get_widget_index
+        appearance_mode: Defaults to APPEARANCE_MODE
+        timings: Optional dict filled with {"edits": {field_id: seconds},
+            "appearances": {page: seconds}}
+
+    Returns:
+        (applied field_ids, {field_id: error} for fields that could not be set)
+    """
+    appearance_mode = appearance_mode or APPEARANCE_MODE
+    errors = {}
+    pdf = fitz._as_pdf_document(doc) if appearance_mode != AppearanceMode.IMMEDIATE else None
+    edit_times = timings.setdefault("edits", {}) if timings is not None else {}
+    page_times = timings.setdefault("appearances", {}) if timings is not None else {}
+
+    # page -> [(field_id, xref, value)]
+    by_page: dict[int, list[tuple[str, int, str | bool]]] = {}
+    for field_id, value in values.items():
+        locations = widget_index.get(field_id)
+        if not locations:
+            errors[field_id] = f"Field not found: {field_id}"
+            continue
+        for page_num, xref in locations:
+            by_page.setdefault(page_num, []).append((field_id, xref, value))
+
+    for page_num in sorted(by_page):
+        # The page must stay referenced while its widgets are modified
+        page = doc[page_num]
+        for field_id, xref, value in by_page[page_num]:
+            if field_id in errors:
+                continue
+            start = time.perf_counter()
+            try:
+                if pdf is None:
+                    _apply_widget_edit(page.load_widget(xref), value)
+                else:
+                    _set_field_value(pdf, xref, value, appearance_mode)
+            except Exception as e:
+                errors[field_id] = f"Failed to apply {field_id}: {str(e)}"
+            edit_times[field_id] = edit_times.get(field_id, 0.0) + time.perf_counter() - start
+
+        if appearance_mode == AppearanceMode.DEFERRED:
+            start = time.perf_counter()
+            fitz.mupdf.pdf_update_page(fitz.mupdf.pdf_page_from_fz_page(page.this))
+            page_times[page_num] = time.perf_counter() - start
+
+    applied = [field_id for field_id in values if field_id not in errors]
+    if appearance_mode == AppearanceMode.NEED_APPEARANCES and applied:
+        doc.need_appearances(True)
+
+    return applied, errors
+
+
+def save_pdf_bytes(doc: fitz.Document, incremental: bool = True) -> bytes:
+    """
+    Serialize a PDF document to bytes.
+
+    With incremental=True the original file is kept byte-for-byte and only
+    the changed objects plus a new xref section are appended, so filling a
+    few fields in a large scanned PDF writes kilobytes instead of
+    re-serializing every object. Falls back to a full rewrite when an
+    incremental update is impossible (encrypted or repaired files) or fails.
+
+    Args:
+        doc: An open document, loaded from a file or from bytes
+        incremental: Try an incremental update before rewriting
+
+    Returns:
+        The complete PDF as bytes
+    """
+    if incremental and _can_save_incrementally(doc):
+        try:
+            return _write_incremental(doc)
+        except Exception as e:
+            print(f"[PDF] Incremental save failed, falling back to full rewrite: {e}")
+    return doc.tobytes()
+
+
 def edit_pdf_with_instructions(
     pdf_bytes: bytes,
     edits: list[dict],  # List of {"field_id": str, "value": str|bool}
+    fields: list[DetectedField] | None = None,
 ) -> bytes:
     """
     Edit a PDF using a pre-computed list of field edits.
@@ -158,6 +608,7 @@ def edit_pdf_with_instructions(
     Args:
         pdf_bytes: The PDF file as bytes
         edits: List of edits with field_id and value
+        fields: Optional detected fields for this PDF (speeds up widget lookup)
         
     Returns:
         Modified PDF as bytes
@@ -169,14 +620,421 @@ def edit_pdf_with_instructions(
         )
         for e in edits
     ]
-    return apply_edits(pdf_bytes, field_edits)
+    return apply_edits(pdf_bytes, field_edits, fields)
+
+
+# ============================================================================
+# Field Detection Cache
+# ============================================================================
+
+# On-disk tier lives next to sessions.db in the backend directory
+_FIELD_CACHE_DB_PATH = Path(__file__).parent / "field_cache.db"
+# Max number of PDFs kept in the in-memory LRU tier
+FIELD_CACHE_MAX_ENTRIES = int(os.environ.get("FIELD_CACHE_MAX_ENTRIES", "256"))
+# Set FIELD_CACHE_DISK=0 to keep the cache in memory only
+FIELD_CACHE_DISK_ENABLED = os.environ.get("FIELD_CACHE_DISK", "1") != "0"
+
+
+class FieldDetectionCache:
+    """
+    Thread-safe two-tier cache for detect_form_fields results.
+
+    Entries are keyed by a SHA-256 of the PDF bytes plus the
+    generate_friendly_labels flag. The memory tier is an LRU of serialized
+    fields; the optional disk tier is a small SQLite table so repeat uploads
+    of common forms stay fast across server restarts.
+
+    Fields are stored as dicts and rebuilt on every hit, so callers can
+    mutate the returned DetectedField objects freely.
+    """
+    def __init__(self, max_entries: int = 256, db_path: str | Path | None = None):
+        self._entries: OrderedDict[str, list[dict]] = OrderedDict()
+        # PDF digest -> {field_id: [(page, widget xref), ...]} (memory only)
+        self._widget_indexes: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self._db_path = str(db_path) if db_path else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self._db_path:
+            self._init_db()
+
+    @staticmethod
+    def digest(pdf_bytes: bytes) -> str:
+        """SHA-256 of the PDF bytes."""
+        return hashlib.sha256(pdf_bytes).hexdigest()
+
+    @classmethod
+    def make_key(cls, pdf_bytes: bytes, generate_friendly_labels: bool) -> str:
+        """Build the cache key for a PDF and label mode."""
+        return f"{cls.digest(pdf_bytes)}:{'labels' if generate_friendly_labels else 'raw'}"
+
+    def _init_db(self):
+        """Initialize the SQLite schema for the disk tier."""
+        try:
+            with sqlite3.connect(self._db_path) as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS field_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        fields TEXT,
+                        created_at REAL
+                    )
+                """)
+                conn.commit()
+        except Exception as e:
+            print(f"[FieldCache] Disabling disk tier, failed to open {self._db_path}: {e}")
+            self._db_path = None
+
+    def get(self, key: str) -> list[DetectedField] | None:
+        """Look up cached fields, checking memory first and then disk."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return [DetectedField.from_dict(d) for d in entry]
+
+        entry = self._read_disk(key)
+        if entry is not None:
+            with self._lock:
+                self.disk_hits += 1
+                self._store(key, entry)
+            return [DetectedField.from_dict(d) for d in entry]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, fields: list[DetectedField]):
+        """Store detected fields in both tiers."""
+        entry = [f.to_dict() for f in fields]
+        with self._lock:
+            self._store(key, entry)
+        self._write_disk(key, entry)
+
+        widget_index = _widget_index_from_fields(fields)
+        if widget_index is not None:
+            self.put_widget_index(key.split(":", 1)[0], widget_index)
+
+    def get_widget_index(self, digest: str) -> dict | None:
+        """Look up the field_id -> [(page, xref)] index for a PDF digest."""
+        with self._lock:
+            widget_index = self._widget_indexes.get(digest)
+            if widget_index is not None:
+                self._widget_indexes.move_to_end(digest)
+            return widget_index
+
+    def put_widget_index(self, digest: str, widget_index: dict):
+        """Store a widget index, sharing the LRU bound of the field tier."""
+        with self._lock:
+            self._widget_indexes[digest] = widget_index
+            self._widget_indexes.move_to_end(digest)
+            while len(self._widget_indexes) > self._max_entries:
+                self._widget_indexes.popitem(last=False)
+
+    def _store(self, key: str, entry: list[dict]):
+        """Insert into the memory tier, evicting the least recently used entry. Caller holds the lock."""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, key: str) -> list[dict] | None:
+        if not self._db_path:
+            return None
+        try:
+            with sqlite3.connect(self._db_path) as conn:
+                row = conn.execute(
+                    "SELECT fields FROM field_cache WHERE cache_key = ?", (key,)
+                ).fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            print(f"[FieldCache] Disk read failed: {e}")
+            return None
+
+    def _write_disk(self, key: str, entry: list[dict]):
+        if not self._db_path:
+            return
+        try:
+            with sqlite3.connect(self._db_path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO field_cache (cache_key, fields, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(entry), time.time())
+                )
+                conn.commit()
+        except Exception as e:
+            print(f"[FieldCache] Disk write failed: {e}")
+
+    def clear(self):
+        """Drop all entries from both tiers and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._widget_indexes.clear()
+            self.memory_hits = self.disk_hits = self.misses = 0
+        if self._db_path:
+            try:
+                with sqlite3.connect(self._db_path) as conn:
+                    conn.execute("DELETE FROM field_cache")
+                    conn.commit()
+            except Exception as e:
+                print(f"[FieldCache] Disk clear failed: {e}")
+
+    def stats(self) -> dict:
+        """Return hit/miss counters for monitoring."""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "disk_enabled": self._db_path is not None,
+            }
+
+
+# Global field detection cache shared by all endpoints and agent tools
+_field_cache = FieldDetectionCache(
+    max_entries=FIELD_CACHE_MAX_ENTRIES,
+    db_path=_FIELD_CACHE_DB_PATH if FIELD_CACHE_DISK_ENABLED else None,
+)
+
+
+# ============================================================================
+# Form Template Registry
+# ============================================================================
+
+# Directory of registered template JSON files (one per fingerprint)
+_TEMPLATE_REGISTRY_DIR = Path(os.environ.get(
+    "TEMPLATE_REGISTRY_DIR", Path(__file__).parent / "form_templates"
+))
+# Set TEMPLATE_AUTO_REGISTER=1 to register every fully labeled form on first analysis
+TEMPLATE_AUTO_REGISTER = os.environ.get("TEMPLATE_AUTO_REGISTER", "0") == "1"
+
+# Per-upload values that are overlaid onto a template's fields
+_TEMPLATE_OVERLAY_KEYS = ("current_value", "widget_xref", "bbox")
+
+
+def compute_form_fingerprint(fields: list[DetectedField]) -> str:
+    """
+    Structural fingerprint of a form: widget names, types and rects per page.
+
+    Values are ignored and rects are rounded to whole points, so blank and
+    filled copies of the same form share a fingerprint.
+    """
+    hasher = hashlib.sha256()
+    for f in fields:
+        x0, y0, x1, y1 = (round(v) for v in f.bbox)
+        hasher.update(f"{f.page}|{f.native_field_name}|{f.field_type.value}|{x0},{y0},{x1},{y1}\n".encode())
+    return hasher.hexdigest()
+
+
+def fingerprint_pdf(pdf_bytes: bytes) -> str:
+    """Compute the structural fingerprint of a PDF (widget scan only, no text extraction)."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return compute_form_fingerprint(_scan_widgets(doc))
+    finally:
+        doc.close()
+
+
+def refresh_field_values(doc: fitz.Document, fields: list[DetectedField]) -> bool:
+    """
+    Refresh previously detected fields from an open copy of the same form.
+
+    Only per-document values (current_value, widget xref, rect) are updated
+    in place; labels and context are kept, so no text extraction or LLM call
+    is needed. Returns False and leaves `fields` untouched when the
+    document's form structure differs.
+    """
+    scanned = _scan_widgets(doc)
+    if not scanned or compute_form_fingerprint(scanned) != compute_form_fingerprint(fields):
+        return False
+    for field, actual in zip(fields, scanned):
+        for key in _TEMPLATE_OVERLAY_KEYS:
+            setattr(field, key, getattr(actual, key))
+    return True
+
+
+class TemplateRegistry:
+    """
+    Registry of fully analyzed form templates keyed by structural fingerprint.
+
+    Each template is stored as a JSON file holding the field list (with
+    label_context and friendly labels) of a blank copy of the form. Seed it
+    offline with `python pdf_processor.py --seed-templates <dir>`.
+    """
+    def __init__(self, directory: str | Path | None = None):
+        self._templates: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._dir = Path(directory) if directory else None
+        self.hits = 0
+        self.misses = 0
+        if self._dir and self._dir.exists():
+            self._load()
+
+    def _load(self):
+        """Load all template files from the registry directory."""
+        for path in sorted(self._dir.glob("*.json")):
+            try:
+                template = json.loads(path.read_text())
+                self._templates[template["fingerprint"]] = template
+            except Exception as e:
+                print(f"[Templates] Skipping invalid template {path.name}: {e}")
+        if self._templates:
+            print(f"[Templates] Loaded {len(self._templates)} form templates from {self._dir}")
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def register(self, fields: list[DetectedField], name: str | None = None) -> str:
+        """Register a fully analyzed field list as a template and return its fingerprint."""
+        fingerprint = compute_form_fingerprint(fields)
+        template = {
+            "fingerprint": fingerprint,
+            "name": name,
+            "created_at": time.time(),
+            "fields": [
+                {**f.to_dict(), "current_value": None, "widget_xref": None}
+                for f in fields
+            ],
+        }
+        with self._lock:
+            self._templates[fingerprint] = template
+        if self._dir:
+            try:
+                self._dir.mkdir(parents=True, exist_ok=True)
+                (self._dir / f"{fingerprint}.json").write_text(json.dumps(template))
+            except Exception as e:
+                print(f"[Templates] Failed to persist template {fingerprint}: {e}")
+        return fingerprint
+
+    def match(self, scanned: list[DetectedField]) -> list[DetectedField] | None:
+        """
+        Look up the template for a widget scan (see _scan_widgets).
+
+        Returns the template's fields with the scan's per-upload values
+        overlaid, or None if the form is not registered.
+        """
+        if not scanned:
+            return None
+        fingerprint = compute_form_fingerprint(scanned)
+        with self._lock:
+            template = self._templates.get(fingerprint)
+            if template is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        fields = []
+        for stored, actual in zip(template["fields"], scanned):
+            field = DetectedField.from_dict(stored)
+            for key in _TEMPLATE_OVERLAY_KEYS:
+                setattr(field, key, getattr(actual, key))
+            fields.append(field)
+        return fields
+
+    def stats(self) -> dict:
+        """Return template count and hit/miss counters for monitoring."""
+        with self._lock:
+            return {"templates": len(self._templates), "hits": self.hits, "misses": self.misses}
+
+
+def seed_templates(directory: str | Path, generate_friendly_labels: bool = True) -> list[str]:
+    """
+    Analyze every blank form PDF in a directory and register it as a template.
+
+    Returns:
+        The fingerprints that were registered
+    """
+    fingerprints = []
+    for path in sorted(Path(directory).glob("*.pdf")):
+        fields = detect_form_fields(
+            path.read_bytes(),
+            generate_friendly_labels=generate_friendly_labels,
+            use_cache=False,
+            use_templates=False,
+        )
+        if not fields:
+            print(f"[Templates] {path.name}: no form fields, skipped")
+            continue
+        fingerprint = _template_registry.register(fields, name=path.name)
+        fingerprints.append(fingerprint)
+        print(f"[Templates] {path.name}: registered {len(fields)} fields ({fingerprint[:12]})")
+    return fingerprints
+
+
+# Global template registry consulted by detect_form_fields
+_template_registry = TemplateRegistry(_TEMPLATE_REGISTRY_DIR)
 
 
 # ============================================================================
 # Helper Functions
 # ============================================================================
 
-def _extract_nearby_text(page: fitz.Page, rect: fitz.Rect, radius: int = 100) -> str:
+class _PageWordIndex:
+    """
+    Spatial index over the words on a single page.
+
+    Built once per page from get_text("words"): word boxes go into a NumPy
+    array and are bucketed into a uniform grid, so each neighbourhood query
+    only tests the words in the cells it overlaps instead of re-extracting
+    the page text.
+    """
+    CELL_SIZE = 64.0
+
+    def __init__(self, page: fitz.Page):
+        self.page_rect = fitz.Rect(page.rect)
+        words = page.get_text("words")
+        self._words = [w[4] for w in words]
+        self._boxes = np.array([w[:4] for w in words], dtype=np.float64).reshape(-1, 4)
+        # (block_no, line_no) identifies the text line a word belongs to
+        self._lines = [(w[5], w[6]) for w in words]
+
+        buckets: dict[tuple[int, int], list[int]] = {}
+        for i, (x0, y0, x1, y1) in enumerate(self._boxes):
+            for cx in range(int(x0 // self.CELL_SIZE), int(x1 // self.CELL_SIZE) + 1):
+                for cy in range(int(y0 // self.CELL_SIZE), int(y1 // self.CELL_SIZE) + 1):
+                    buckets.setdefault((cx, cy), []).append(i)
+        self._grid = {cell: np.array(ids, dtype=np.intp) for cell, ids in buckets.items()}
+
+    def query(self, rect: fitz.Rect) -> list[str]:
+        """Return the text lines (in reading order) of words overlapping rect."""
+        if rect.is_empty or not self._grid:
+            return []
+
+        cells = [
+            self._grid[(cx, cy)]
+            for cx in range(int(rect.x0 // self.CELL_SIZE), int(rect.x1 // self.CELL_SIZE) + 1)
+            for cy in range(int(rect.y0 // self.CELL_SIZE), int(rect.y1 // self.CELL_SIZE) + 1)
+            if (cx, cy) in self._grid
+        ]
+        if not cells:
+            return []
+
+        # np.unique also sorts, which restores the page's reading order
+        candidates = np.unique(np.concatenate(cells))
+        boxes = self._boxes[candidates]
+        hits = candidates[
+            (boxes[:, 0] < rect.x1) & (boxes[:, 2] > rect.x0)
+            & (boxes[:, 1] < rect.y1) & (boxes[:, 3] > rect.y0)
+        ]
+
+        lines: list[str] = []
+        current_line = None
+        for i in hits:
+            if self._lines[i] != current_line:
+                current_line = self._lines[i]
+                lines.append(self._words[i])
+            else:
+                lines[-1] += " " + self._words[i]
+        return lines
+
+
+def _extract_nearby_text(word_index: "_PageWordIndex", rect: fitz.Rect, radius: int = 100) -> str:
     """
     Extract text near a bounding box to understand field context.
 
@@ -184,6 +1042,7 @@ def _extract_nearby_text(page: fitz.Page, rect: fitz.Rect, radius: int = 100) ->
     surrounding labels and text.
 
     Returns ALL nearby text (no arbitrary limits) for LLM processing.
+    Words straddling the edge of the search area are kept whole.
     """
     # Expand the search area
     search_rect = fitz.Rect(rect)
@@ -193,14 +1052,84 @@ def _extract_nearby_text(page: fitz.Page, rect: fitz.Rect, radius: int = 100) ->
     search_rect.y1 += radius
 
     # Clip to page bounds
-    page_rect = page.rect
-    search_rect.intersect(page_rect)
-
-    text = page.get_text("text", clip=search_rect).strip()
+    search_rect.intersect(word_index.page_rect)
 
     # Clean up whitespace but keep ALL text
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    return ' | '.join(lines)
+    return ' | '.join(word_index.query(search_rect))
+
+
+def _widget_index_from_fields(fields: list[DetectedField]) -> dict | None:
+    """Build a field_id -> [(page, widget xref)] index from detected fields, if they carry xrefs."""
+    widget_index: dict[str, list[tuple[int, int]]] = {}
+    for f in fields:
+        if f.widget_xref is None:
+            return None
+        widget_index.setdefault(f.field_id, []).append((f.page, f.widget_xref))
+    return widget_index
+
+
+def get_widget_index(
+    doc: fitz.Document,
+    fields: list[DetectedField] | None = None,
+    pdf_bytes: bytes | None = None,
+) -> dict:
+    """
+    Get the field_id -> [(page, widget xref)] index for a PDF.
+
+    Prefers the caller's fields, then the cache (when pdf_bytes is given),
+    and only walks the document's widgets when neither is available.
+    """
+    if fields:
+        widget_index = _widget_index_from_fields(fields)
+        if widget_index is not None:
+            return widget_index
+
+    digest = None
+    if pdf_bytes is not None:
+        digest = FieldDetectionCache.digest(pdf_bytes)
+        widget_index = _field_cache.get_widget_index(digest)
+        if widget_index is not None:
+            return widget_index
+
+    widget_index = {}
+    for page_num in range(len(doc)):
+        for widget in doc[page_num].widgets():
+            if not widget.field_name:
+                continue
+            field_id = f"page{page_num}_{widget.field_name}"
+            widget_index.setdefault(field_id, []).append((page_num, widget.xref))
+    if digest is not None:
+        _field_cache.put_widget_index(digest, widget_index)
+    return widget_index
+
+
+def _can_save_incrementally(doc: fitz.Document) -> bool:
+    """Whether appending an update section to the original bytes is safe."""
+    if doc.is_encrypted or doc.metadata.get("encryption"):
+        return False
+    # Repaired files have a rebuilt xref that no longer matches the original bytes
+    if doc.is_repaired:
+        return False
+    return bool(doc.can_save_incrementally())
+
+
+def _write_incremental(doc: fitz.Document) -> bytes:
+    """
+    Write the original PDF plus an incremental update section.
+
+    Document.save() only allows incremental saves back to the file the
+    document was opened from, so this calls MuPDF's pdf_write_document
+    directly with an in-memory output; MuPDF copies the original bytes
+    (file or stream) and appends the changed objects.
+    """
+    pdf = fitz._as_pdf_document(doc)
+    opts = fitz.mupdf.PdfWriteOptions()
+    opts.do_incremental = 1
+    buffer = fitz.mupdf.fz_new_buffer(8192)
+    out = fitz.mupdf.FzOutput(buffer)
+    fitz.mupdf.pdf_write_document(pdf, out, opts)
+    out.fz_close_output()
+    return bytes(fitz.JM_BinFromBuffer(buffer))
 
 
 def _widget_type_to_field_type(widget_type: int) -> FieldType:
@@ -222,7 +1151,7 @@ def _apply_widget_edit(widget: fitz.Widget, value: str | bool):
     if widget_type == fitz.PDF_WIDGET_TYPE_CHECKBOX:
         # For checkboxes, convert string "true"/"false" to bool
         if isinstance(value, str):
-            value = value.lower() in ('true', 'yes', '1', 'checked')
+            value = value.lower() in _CHECKED_VALUES
         widget.field_value = value
 
     elif widget_type == fitz.PDF_WIDGET_TYPE_RADIOBUTTON:
@@ -236,19 +1165,192 @@ def _apply_widget_edit(widget: fitz.Widget, value: str | bool):
     widget.update()
 
 
-def _generate_friendly_labels(fields: list[DetectedField]) -> list[DetectedField]:
+# Strings accepted as "checked" for checkbox edits
+_CHECKED_VALUES = ('true', 'yes', '1', 'checked', 'on')
+
+
+def _set_field_value(pdf, xref: int, value: str | bool, appearance_mode: AppearanceMode):
+    """
+    Write a widget's value without regenerating its appearance.
+
+    MuPDF marks the field dirty, so a later pdf_update_page on its page
+    rebuilds the appearance stream (DEFERRED mode).
+    """
+    mupdf = fitz.mupdf
+    obj = mupdf.pdf_new_indirect(pdf, xref, 0)
+    widget_type = mupdf.pdf_field_type(obj)
+
+    if widget_type == fitz.PDF_WIDGET_TYPE_RADIOBUTTON:
+        # Only the button whose on-state is the value is selected. The group
+        # shares one /V, so the other buttons are switched off through /AS
+        # alone - writing "Off" through them would clear the selection made
+        # by their sibling.
+        on_state = mupdf.pdf_to_name(mupdf.pdf_button_field_on_state(obj))
+        if value == on_state:
+            text = on_state
+        else:
+            mupdf.pdf_dict_put(obj, mupdf.pdf_new_name("AS"), mupdf.pdf_new_name("Off"))
+            if mupdf.pdf_field_value(obj) != on_state:
+                return
+            # This button held the selection: clear it for the whole group
+            text = "Off"
+    elif widget_type == fitz.PDF_WIDGET_TYPE_CHECKBOX:
+        on_state = mupdf.pdf_to_name(mupdf.pdf_button_field_on_state(obj))
+        checked = (
+            value is True
+            or (isinstance(value, str) and (value == on_state or value.lower() in _CHECKED_VALUES))
+        )
+        text = on_state if checked else "Off"
+    else:
+        text = str(value)
+
+    mupdf.pdf_set_field_value(pdf, obj, text, 1)
+
+    if appearance_mode == AppearanceMode.NEED_APPEARANCES and widget_type not in (
+        fitz.PDF_WIDGET_TYPE_CHECKBOX, fitz.PDF_WIDGET_TYPE_RADIOBUTTON
+    ):
+        # The old appearance still shows the previous value; let the viewer redraw it
+        mupdf.pdf_dict_del(obj, mupdf.pdf_new_name("AP"))
+
+
+# Max fields per friendly-label request; keeps each JSON response well under max_tokens
+LABEL_BATCH_SIZE = int(os.environ.get("LABEL_BATCH_SIZE", "60"))
+# Max friendly-label requests in flight at once for a single form
+LABEL_CONCURRENCY = int(os.environ.get("LABEL_CONCURRENCY", "4"))
+
+
+def _generate_friendly_labels(
+    fields: list[DetectedField],
+    batch_size: int = LABEL_BATCH_SIZE,
+    concurrency: int = LABEL_CONCURRENCY,
+    api_key: str | None = None,
+) -> tuple[list[DetectedField], bool]:
     """
     Use Claude to generate clean, user-friendly labels for form fields.
 
     Takes the full label_context and native field names and produces
-    concise, descriptive labels for display.
+    concise, descriptive labels for display. Returns the fields and whether
+    every label request succeeded.
+
+    Sync entry point for detect_form_fields; see _generate_friendly_labels_async.
     """
-    try:
-        client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+    return _run_coroutine_sync(_generate_friendly_labels_async(fields, batch_size, concurrency, api_key))
+
+
+async def _generate_friendly_labels_async(
+    fields: list[DetectedField],
+    batch_size: int = LABEL_BATCH_SIZE,
+    concurrency: int = LABEL_CONCURRENCY,
+    api_key: str | None = None,
+) -> tuple[list[DetectedField], bool]:
+    """
+    Generate friendly labels in page-bounded batches, running up to
+    `concurrency` requests at once.
+
+    Each batch falls back to native field names on its own, so one
+    truncated or failed response no longer discards every label. The
+    returned flag is False if any batch failed, so callers don't cache the
+    fallbacks as real labels.
+    """
+    labeled = 0
+    batch_count = 0
+    complete = True
+    async for batch_labels, batch_ok in _iter_friendly_label_batches(fields, batch_size, concurrency, api_key):
+        batch_count += 1
+        complete = complete and batch_ok
+        for i, label in batch_labels.items():
+            if label != fields[i].native_field_name:
+                labeled += 1
+            fields[i].friendly_label = label
+
+    print(f"[Labels] Labeled {labeled}/{len(fields)} fields in {batch_count} batch(es)")
+    return fields, complete
+
+
+async def _iter_friendly_label_batches(
+    fields: list[DetectedField],
+    batch_size: int = LABEL_BATCH_SIZE,
+    concurrency: int = LABEL_CONCURRENCY,
+    api_key: str | None = None,
+) -> AsyncGenerator[tuple[dict[int, str], bool], None]:
+    """
+    Run the label batches concurrently and yield each batch's labels as it
+    completes, as (map of field index -> label, whether the request succeeded).
+
+    Every index in a batch gets a label; fields the LLM didn't label (or
+    whose batch failed) fall back to the native field name. Batches still
+    in flight are cancelled if the consumer stops iterating. The client is
+    built per call from api_key, so concurrent forms can use different keys.
+    """
+    batches = _batch_fields_for_labeling(fields, batch_size)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async with AsyncAnthropic(api_key=api_key or os.environ.get("ANTHROPIC_API_KEY")) as client:
+        async def run_batch(indices: list[int]) -> tuple[dict[int, str], bool]:
+            async with semaphore:
+                labels = await _request_friendly_labels(client, fields, indices)
+            ok = labels is not None
+            labels = labels or {}
+            return {i: labels.get(i) or fields[i].native_field_name for i in indices}, ok
+
+        tasks = [asyncio.create_task(run_batch(b)) for b in batches]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def _batch_fields_for_labeling(fields: list[DetectedField], batch_size: int) -> list[list[int]]:
+    """
+    Split field indices into batches of at most batch_size.
+
+    Whole pages are kept together where they fit so the LLM sees related
+    fields side by side; pages larger than batch_size are split.
+    """
+    batch_size = max(1, batch_size)
+
+    pages: list[list[int]] = []
+    for i, field in enumerate(fields):
+        if pages and fields[pages[-1][0]].page == field.page:
+            pages[-1].append(i)
+        else:
+            pages.append([i])
+
+    batches: list[list[int]] = []
+    current: list[int] = []
+    for page_indices in pages:
+        if current and len(current) + len(page_indices) > batch_size:
+            batches.append(current)
+            current = []
+        for start in range(0, len(page_indices), batch_size):
+            chunk = page_indices[start:start + batch_size]
+            if len(chunk) == batch_size:
+                batches.append(chunk)
+            else:
+                current.extend(chunk)
+    if current:
+        batches.append(current)
+    return batches
+
 
+async def _request_friendly_labels(
+    client: AsyncAnthropic,
+    fields: list[DetectedField],
+    indices: list[int],
+) -> dict[int, str] | None:
+    """
+    Ask Claude for labels for one batch of fields.
+
+    Returns a map of field index -> label, or None if the request or
+    response parsing fails.
+    """
+    try:
         # Prepare field summaries for the LLM
         field_summaries = []
-        for i, field in enumerate(fields):
+        for i in indices:
+            field = fields[i]
             field_summaries.append({
                 "index": i,
                 "field_id": field.field_id,
@@ -272,7 +1374,7 @@ Fields to analyze:
 Respond with a JSON object where keys are field indices (as strings) and values are the friendly labels.
 Example: {{"0": "Full Name", "1": "Business Name"}}"""
 
-        response = client.messages.create(
+        response = await client.messages.create(
             model="claude-sonnet-4-5",
             max_tokens=4096,
             messages=[{"role": "user", "content": prompt}]
@@ -289,23 +1391,31 @@ Example: {{"0": "Full Name", "1": "Business Name"}}"""
 
         labels_map = json.loads(response_text)
 
-        # Apply the friendly labels
-        for i, field in enumerate(fields):
-            label = labels_map.get(str(i))
-            if label:
-                field.friendly_label = label
-            else:
-                # Fallback to native field name
-                field.friendly_label = field.native_field_name
-
-        return fields
+        wanted = set(indices)
+        return {
+            int(k): v for k, v in labels_map.items()
+            if isinstance(v, str) and v and k.isdigit() and int(k) in wanted
+        }
 
     except Exception as e:
-        print(f"Warning: Failed to generate friendly labels: {e}")
-        # On error, fallback to native field names
-        for field in fields:
-            field.friendly_label = field.native_field_name
-        return fields
+        print(f"Warning: Failed to generate friendly labels for {len(indices)} fields: {e}")
+        return None
+
+
+def _run_coroutine_sync(coro):
+    """
+    Run a coroutine to completion from sync code.
+
+    detect_form_fields is called from inside FastAPI's event loop, where
+    asyncio.run() is not allowed, so in that case the coroutine gets its own
+    loop on a short-lived worker thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
 
 
 # ============================================================================
@@ -340,14 +1450,17 @@ def get_form_summary(pdf_bytes: bytes) -> str:
 
 if __name__ == "__main__":
     # Quick test - you can run this file directly to test
-    import sys
-    
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 2 and sys.argv[1] == "--seed-templates":
+        fingerprints = seed_templates(sys.argv[2])
+        print(f"Registered {len(fingerprints)} templates in {_TEMPLATE_REGISTRY_DIR}")
+    elif len(sys.argv) > 1:
         pdf_path = sys.argv[1]
         with open(pdf_path, 'rb') as f:
             pdf_bytes = f.read()
         print(get_form_summary(pdf_bytes))
     else:
         print("Usage: python pdf_processor.py <path_to_pdf>")
-        print("\nThis will show all detected form fields in the PDF.")
+        print("       python pdf_processor.py --seed-templates <dir_of_blank_forms>")
+        print("\nThis will show all detected form fields in the PDF,")
+        print("or register every PDF in the directory as a known form template.")
 
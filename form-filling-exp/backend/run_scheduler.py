@@ -0,0 +1,187 @@
+"""
+Admission control for agent runs.
+
+Every agent run holds a CLI process, an MCP server and a share of the
+upstream rate limit, so a traffic spike that starts all runs at once takes
+everyone down together. The scheduler puts a bounded queue in front of the
+runs instead:
+
+- at most AGENT_MAX_CONCURRENT_RUNS run at once per worker, and at most
+  AGENT_MAX_RUNS_PER_USER for any one user (upstream limits are per key);
+- up to AGENT_MAX_QUEUED_RUNS wait in line, and anything beyond that is
+  rejected straight away rather than piling up;
+- continuation turns (short, interactive edits) go ahead of fresh first-turn
+  fills, but a fresh run that has waited AGENT_QUEUE_AGING_SECONDS is
+  treated as a continuation so it cannot be starved.
+
+Waiting callers get their queue position whenever it changes, which the
+streaming endpoint forwards as SSE "queued" events.
+"""
+
+import asyncio
+import itertools
+import os
+import time
+from typing import AsyncIterator, Hashable
+
+
+# Agent runs executing at once in this worker
+AGENT_MAX_CONCURRENT_RUNS = int(os.environ.get("AGENT_MAX_CONCURRENT_RUNS", "8"))
+# Agent runs executing at once for a single user
+AGENT_MAX_RUNS_PER_USER = int(os.environ.get("AGENT_MAX_RUNS_PER_USER", "2"))
+# Runs allowed to wait for a slot before new ones are rejected
+AGENT_MAX_QUEUED_RUNS = int(os.environ.get("AGENT_MAX_QUEUED_RUNS", "32"))
+# Seconds after which a waiting first-turn run gets continuation priority
+AGENT_QUEUE_AGING_SECONDS = float(os.environ.get("AGENT_QUEUE_AGING_SECONDS", "30"))
+
+
+class QueueFullError(RuntimeError):
+    """Raised by RunScheduler.enqueue when the wait queue is at capacity."""
+
+
+class RunTicket:
+    """A run's place in the scheduler: waiting, then running, then released."""
+    def __init__(self, scheduler: "RunScheduler", user: Hashable, continuation: bool, seq: int):
+        self._scheduler = scheduler
+        self.user = user
+        self.continuation = continuation
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.position: int | None = None
+        self.admitted = False
+        self.released = False
+        self._changed = asyncio.Event()
+
+    def _priority(self, now: float) -> tuple[int, int]:
+        """Sort key: continuations (and aged fresh runs) first, then arrival order."""
+        urgent = self.continuation or now - self.enqueued_at >= self._scheduler.aging_seconds
+        return (0 if urgent else 1, self.seq)
+
+    async def wait(self) -> AsyncIterator[int]:
+        """
+        Wait for a slot, yielding the 1-based queue position each time it changes.
+
+        Yields nothing if the run is admitted immediately.
+        """
+        last = None
+        while True:
+            # Clear before checking: admission may have happened while the
+            # caller was suspended at the yield below, and must not be lost
+            self._changed.clear()
+            if self.admitted:
+                return
+            if self.position != last:
+                last = self.position
+                yield self.position
+                continue
+            await self._changed.wait()
+
+    async def wait_until_admitted(self):
+        """Wait for a slot without reporting queue positions."""
+        async for _ in self.wait():
+            pass
+
+    def release(self):
+        """Give the slot back (or leave the queue). Safe to call more than once."""
+        self._scheduler._release(self)
+
+    @property
+    def waited_seconds(self) -> float:
+        return time.monotonic() - self.enqueued_at
+
+
+class RunScheduler:
+    """Global and per-user concurrency caps with a bounded priority queue."""
+    def __init__(
+        self,
+        max_concurrent: int = AGENT_MAX_CONCURRENT_RUNS,
+        max_per_user: int = AGENT_MAX_RUNS_PER_USER,
+        max_queued: int = AGENT_MAX_QUEUED_RUNS,
+        aging_seconds: float = AGENT_QUEUE_AGING_SECONDS,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_per_user = max(1, max_per_user)
+        self.max_queued = max(0, max_queued)
+        self.aging_seconds = aging_seconds
+        self._waiting: list[RunTicket] = []
+        self._running_by_user: dict[Hashable, int] = {}
+        self._running = 0
+        self._seq = itertools.count()
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "max_wait_seconds": 0.0}
+
+    def enqueue(self, user: Hashable, continuation: bool = False) -> RunTicket:
+        """
+        Ask for a run slot. The ticket is admitted right away when there is
+        capacity; otherwise it waits in the queue (see RunTicket.wait).
+
+        Raises:
+            QueueFullError: The queue already holds max_queued waiting runs
+        """
+        ticket = RunTicket(self, user, continuation, next(self._seq))
+        self._waiting.append(ticket)
+        self._dispatch()
+        if not ticket.admitted:
+            if len(self._waiting) > self.max_queued:
+                self._waiting.remove(ticket)
+                ticket.released = True
+                self._dispatch()
+                self._stats["rejected"] += 1
+                raise QueueFullError(
+                    f"Too many agent runs waiting ({self.max_queued}); please try again shortly"
+                )
+            self._stats["queued"] += 1
+        return ticket
+
+    def _dispatch(self):
+        """Admit waiting runs in priority order while capacity allows, then renumber the rest."""
+        now = time.monotonic()
+        self._waiting.sort(key=lambda t: t._priority(now))
+
+        for ticket in list(self._waiting):
+            if self._running >= self.max_concurrent:
+                break
+            # A user at their cap doesn't hold up other users behind them
+            if self._running_by_user.get(ticket.user, 0) >= self.max_per_user:
+                continue
+            self._waiting.remove(ticket)
+            self._running += 1
+            self._running_by_user[ticket.user] = self._running_by_user.get(ticket.user, 0) + 1
+            ticket.admitted = True
+            ticket.position = None
+            self._stats["admitted"] += 1
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], round(ticket.waited_seconds, 3))
+            ticket._changed.set()
+
+        for position, ticket in enumerate(self._waiting, 1):
+            if ticket.position != position:
+                ticket.position = position
+                ticket._changed.set()
+
+    def _release(self, ticket: RunTicket):
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.admitted:
+            self._running -= 1
+            remaining = self._running_by_user.get(ticket.user, 1) - 1
+            if remaining:
+                self._running_by_user[ticket.user] = remaining
+            else:
+                self._running_by_user.pop(ticket.user, None)
+        elif ticket in self._waiting:
+            self._waiting.remove(ticket)
+        self._dispatch()
+
+    def stats(self) -> dict:
+        """Current load and lifetime admission counters."""
+        return {
+            **self._stats,
+            "running": self._running,
+            "waiting": len(self._waiting),
+            "max_concurrent": self.max_concurrent,
+            "max_per_user": self.max_per_user,
+        }
+
+
+# Global scheduler shared by the agent endpoints
+_run_scheduler = RunScheduler()
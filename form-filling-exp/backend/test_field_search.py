@@ -0,0 +1,52 @@
+"""
+Checks for the ranked field search index.
+
+Usage:
+    python test_field_search.py
+    python -m pytest test_field_search.py
+"""
+
+from field_search import FieldSearchIndex
+from pdf_processor import DetectedField, FieldType
+
+
+def _field(field_id: str, label: str, context: str, native: str, field_type: FieldType = FieldType.TEXT):
+    return DetectedField(
+        field_id=field_id,
+        field_type=field_type,
+        bbox=(0, 0, 1, 1),
+        page=0,
+        label_context=context,
+        native_field_name=native,
+        friendly_label=label,
+    )
+
+
+def test_radio_group_ranked_once_without_skewing_others():
+    """A many-widget radio group is one document and doesn't shift BM25 length normalisation."""
+    radio = [
+        _field("page0_Choice", "Choice", f"Option {i}", "Choice", FieldType.RADIO)
+        for i in range(12)
+    ]
+    fields = radio + [
+        _field("page0_Fax", "Fax", "Fax or phone", "Fax"),
+        _field(
+            "page0_DayPhone",
+            "Daytime phone",
+            "Daytime telephone number of the applicant including the area code "
+            "and any extension where you can be reached during business hours",
+            "f1_07",
+        ),
+    ]
+    index = FieldSearchIndex(fields)
+
+    # The field labelled "phone" outranks one that only mentions it in nearby text
+    assert [f.field_id for f, _ in index.search("phone")] == ["page0_DayPhone", "page0_Fax"]
+
+    # Option captions still find the group, which is returned once
+    assert [f.field_id for f, _ in index.search("option choice")] == ["page0_Choice"]
+
+
+if __name__ == "__main__":
+    test_radio_group_ranked_once_without_skewing_others()
+    print("ok")
@@ -0,0 +1,69 @@
+"""
+Checks for PDF field editing.
+
+Usage:
+    python test_pdf_processor.py
+    python -m pytest test_pdf_processor.py
+"""
+
+import fitz
+
+from pdf_processor import AppearanceMode, FieldEdit, apply_edits, detect_form_fields
+
+
+def _radio_group_pdf(states: tuple[str, ...] = ("S", "M", "L")) -> bytes:
+    """A one-page PDF with a single radio group "Size", one button per state."""
+    doc = fitz.open()
+    page = doc.new_page()
+    parent = doc.get_new_xref()
+    kids = []
+    for i, state in enumerate(states):
+        x0 = 80 + i * 60
+        on_ap, off_ap = doc.get_new_xref(), doc.get_new_xref()
+        for xref, stream in ((on_ap, b"0 g 2 2 8 8 re f"), (off_ap, b"")):
+            doc.update_object(xref, "<</Type/XObject/Subtype/Form/BBox[0 0 12 12]/Length 0>>")
+            doc.update_stream(xref, stream)
+        kid = doc.get_new_xref()
+        doc.update_object(
+            kid,
+            f"<</Type/Annot/Subtype/Widget/Parent {parent} 0 R/P {page.xref} 0 R"
+            f"/Rect[{x0} 700 {x0 + 12} 712]/AS/Off/MK<<>>"
+            f"/AP<</N<</{state} {on_ap} 0 R/Off {off_ap} 0 R>>>>>>",
+        )
+        kids.append(kid)
+    refs = " ".join(f"{k} 0 R" for k in kids)
+    # Ff 49152 = Radio | NoToggleToOff
+    doc.update_object(parent, f"<</FT/Btn/Ff 49152/T(Size)/V/Off/Kids[{refs}]>>")
+    doc.xref_set_key(page.xref, "Annots", f"[{refs}]")
+    doc.xref_set_key(doc.pdf_catalog(), "AcroForm", f"<</Fields[{parent} 0 R]>>")
+    return doc.tobytes()
+
+
+def _radio_states(pdf_bytes: bytes) -> list[str]:
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    return [doc.xref_get_key(w.xref, "AS")[1] for w in doc[0].widgets()]
+
+
+def test_radio_group_selects_one_button():
+    """Deferred and NeedAppearances writes must leave exactly the chosen button on."""
+    pdf_bytes = _radio_group_pdf()
+    fields = detect_form_fields(pdf_bytes, generate_friendly_labels=False, use_cache=False)
+    field_id = fields[0].field_id
+
+    for mode in (AppearanceMode.DEFERRED, AppearanceMode.NEED_APPEARANCES):
+        filled = apply_edits(pdf_bytes, [FieldEdit(field_id, "M")], fields, appearance_mode=mode)
+        assert _radio_states(filled) == ["/Off", "/M", "/Off"], mode
+
+        # Switching the selection turns the previous button off
+        switched = apply_edits(filled, [FieldEdit(field_id, "S")], fields, appearance_mode=mode)
+        assert _radio_states(switched) == ["/S", "/Off", "/Off"], mode
+
+        # Checkbox-style values are not an option of the group, so nothing is selected
+        for value in ("yes", "true"):
+            filled = apply_edits(pdf_bytes, [FieldEdit(field_id, value)], fields, appearance_mode=mode)
+            assert _radio_states(filled) == ["/Off", "/Off", "/Off"], (mode, value)
+
+
+if __name__ == "__main__":
+    test_radio_group_selects_one_button()
+    print("ok")
@@ -0,0 +1,72 @@
+"""
+Checks for the agent run scheduler.
+
+Usage:
+    python test_run_scheduler.py
+    python -m pytest test_run_scheduler.py
+"""
+
+import asyncio
+
+from run_scheduler import QueueFullError, RunScheduler
+
+
+def test_admission_while_consumer_is_suspended():
+    """A ticket admitted while its consumer is busy between yields must still wake it."""
+    async def scenario():
+        scheduler = RunScheduler(max_concurrent=1, max_per_user=1)
+        a = scheduler.enqueue("a")
+        b = scheduler.enqueue("b")
+        positions = []
+
+        async def consume():
+            async for position in b.wait():
+                positions.append(position)
+                # Stands in for sending the SSE chunk; admission happens meanwhile
+                await asyncio.sleep(0.01)
+
+        consumer = asyncio.create_task(consume())
+        await asyncio.sleep(0)
+        a.release()
+        await asyncio.wait_for(consumer, timeout=1)
+        assert positions == [1]
+        assert b.admitted
+        b.release()
+        assert scheduler.stats()["running"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_caps_priority_and_rejection():
+    async def scenario():
+        scheduler = RunScheduler(max_concurrent=2, max_per_user=1, max_queued=2)
+        a = scheduler.enqueue("u1")
+        b = scheduler.enqueue("u1")
+        c = scheduler.enqueue("u2")
+        assert a.admitted and c.admitted and not b.admitted
+
+        cont = scheduler.enqueue("u3", continuation=True)
+        assert cont.position == 1 and b.position == 2
+        try:
+            scheduler.enqueue("u4")
+        except QueueFullError:
+            pass
+        else:
+            raise AssertionError("queue should be full")
+
+        # u1 is at its cap, so freeing a u2 slot admits the continuation
+        c.release()
+        assert cont.admitted and b.position == 1
+        a.release()
+        assert b.admitted
+        for ticket in (b, cont):
+            ticket.release()
+        assert scheduler.stats()["running"] == 0
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_admission_while_consumer_is_suspended()
+    test_caps_priority_and_rejection()
+    print("ok")
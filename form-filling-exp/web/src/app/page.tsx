@@ -536,6 +536,22 @@ function createLogEntry(event: StreamEvent): AgentLogEntry | null {
         content: event.message || 'Processing...',
       };
 
+    case 'queued':
+      return {
+        id,
+        type: 'status',
+        timestamp,
+        content: event.message || `Waiting for a free agent slot (position ${event.position})...`,
+      };
+
+    case 'budget_exceeded':
+      return {
+        id,
+        type: 'status',
+        timestamp,
+        content: event.message || 'Agent stopped at its time or step limit',
+      };
+
     case 'tool_use':
       if (event.friendly && event.friendly.length > 0) {
         // Clean up markdown formatting
@@ -46,9 +46,10 @@ export interface ToolCall {
 
 // Streaming event types from agent
 export interface StreamEvent {
-  type: 'init' | 'status' | 'tool_use' | 'user' | 'assistant' | 'complete' | 'pdf_ready' | 'error';
+  type: 'init' | 'status' | 'queued' | 'tool_use' | 'user' | 'assistant' | 'budget_exceeded' | 'complete' | 'pdf_ready' | 'error';
   message?: string;
   error?: string;
+  position?: number;  // Place in the run queue (queued events)
   text?: string;
   friendly?: string[];
   tool_calls?: ToolCall[];